@@ -0,0 +1,405 @@
+"""
+Micro-benchmarks for the hot paths of railworks-dsd. They run against fakes, no Train Simulator or footpedal needed.
+
+    python benchmarks.py [name ...]
+"""
+import datetime
+import functools
+import os
+import random
+import select
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+import mock
+import raildriver
+
+import conformance
+import dsd
+
+
+class FakeRailDriver(object):
+
+    def __init__(self, controls):
+        self.values = dict((name, 0.0) for name in controls)
+
+    def get_current_controller_value(self, name):
+        return self.values[name]
+
+    def get_current_time(self):
+        return None
+
+    def get_loco_name(self):
+        return None
+
+    def jitter(self, moving):
+        for name in random.sample(sorted(self.values), moving):
+            self.values[name] += random.choice((-0.2, -0.001, 0.001, 0.2))
+
+
+class BenchPedal(object):
+    """
+    Fake footpedal that alternates depress and release every period seconds starting at start.
+    """
+
+    def __init__(self, usb_reader, vendor_id, product_id, start=None, count=50, period=0.02):
+        self.thread = threading.Thread(target=self.emit, args=(usb_reader, start, count, period))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def emit(self, usb_reader, start, count, period):
+        for index in range(count):
+            time.sleep(max(start + index * period - time.time(), 0))
+            usb_reader.handle_edge('on_release' if index % 2 else 'on_depress', time.time())
+
+    def close(self):
+        pass
+
+
+class BenchUSBReader(dsd.USBReader):
+
+    def __init__(self, device_factory):
+        self.device_factory = device_factory
+        super(BenchUSBReader, self).__init__(0x05f3, 0x00ff)
+
+    def instantiate_device(self, vendor_id, product_id):
+        return self.device_factory(self, vendor_id, product_id)
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return 'mean {:6.2f} ms  p99 {:6.2f} ms  max {:6.2f} ms'.format(
+        sum(samples) / len(samples) * 1e3, samples[int(len(samples) * 0.99)] * 1e3, samples[-1] * 1e3)
+
+
+def bench_pedal_latency(count=100, period=0.02, load_threads=2):
+    """
+    Footpedal edges read in-process vs through ProcessUSBReader while this process runs CPU-bound threads.
+
+    Capture error is how late the edge timestamp is compared to when the edge happened, delivery is how late the
+    bindings ran.
+    """
+    def burn():
+        while loaded[0]:
+            sum(range(1000))
+
+    for label in ('in-process USBReader', 'ProcessUSBReader'):
+        start = time.time() + 1.0
+        factory = functools.partial(BenchPedal, start=start, count=count, period=period)
+        received = []
+        loaded = [True]
+        load = [threading.Thread(target=burn) for _ in range(load_threads)]
+        for thread in load:
+            thread.start()
+
+        if label == 'ProcessUSBReader':
+            reader = dsd.ProcessUSBReader(0x05f3, 0x00ff, device_factory=factory)
+        else:
+            reader = BenchUSBReader(factory)
+        record = lambda: received.append((reader.edge_timestamp, time.time()))
+        reader.on_depress(record)
+        reader.on_release(record)
+        while len(received) < count and time.time() < start + count * period + 5:
+            time.sleep(0.05)
+        loaded[0] = False
+        for thread in load:
+            thread.join()
+        reader.close()
+
+        scheduled = [start + index * period for index in range(len(received))]
+        print('{:22} {:3d} edges'.format(label, len(received)))
+        print('  capture error  {}'.format(percentiles([captured - due for (captured, _), due
+                                                        in zip(received, scheduled)])))
+        print('  delivery       {}'.format(percentiles([delivered - due for (_, delivered), due
+                                                        in zip(received, scheduled)])))
+
+
+def bench_keepalive(hours=1, driver_gap=(20, 180)):
+    """
+    Faux controller DLL writes per simulated hour: a nudge on every time change vs KeepAliveScheduler, for a driver
+    who leaves the controls alone and one who moves a control every driver_gap seconds.
+    """
+    seconds = int(hours * 3600)
+    random.seed(0)
+    moved_at = set()
+    now = 0
+    while now < seconds:
+        now += random.randint(*driver_gap)
+        moved_at.add(now)
+
+    for driver, activity in (('idle driver', set()), ('active driver', moved_at)):
+        scheduler = dsd.machine.models.KeepAliveScheduler()
+        writes = 0
+        for now in range(seconds):
+            if now in activity:
+                scheduler.reset(now)
+            if scheduler.next_delta(now, dsd.DEFAULTS.builtin_vigilance_period) is not None:
+                writes += 1
+        print('{:14} every time change {:5d} writes/h  KeepAliveScheduler {:4d} writes/h  ({:.1f}x fewer)'.format(
+            driver, int(seconds / hours), int(writes / hours), seconds / float(max(writes, 1))))
+
+
+LOADING_SEQUENCES = {
+    'scenario load': [
+        (0.0, None, False),
+        (0.3, ['RSC', 'Class66Pack02', 'Class 66 EWS'], False),
+        (2.5, ['RSC', 'Class66Pack02', 'Class 66 EWS'], True),
+    ],
+    'cab switch flapping': [
+        (0.0, ['RSC', 'Class66Pack02', 'Class 66 EWS'], True),
+        (0.2, ['RSC', 'Class325Pack01', 'Class 325'], True),
+        (0.6, ['RSC', 'Class66Pack02', 'Class 66 EWS'], True),
+        (1.0, ['RSC', 'Class325Pack01', 'Class 325'], True),
+    ],
+    'placeholder loco': [
+        (0.0, None, False),
+        (0.5, ['Kuju', 'RailSimulator', 'Placeholder'], False),
+        (1.2, None, False),
+        (1.5, ['RSC', 'GEML', 'Class 360'], False),
+        (4.0, ['RSC', 'GEML', 'Class 360'], True),
+    ],
+}
+"""
+Replayed loco name and controller list readiness changes: (seconds since start, loco name, controller list ready)
+"""
+
+
+def bench_loco_changes(step=0.1):
+    """
+    Machine rebuilds and time to armed while replaying loading sequences: a restart on every loco name change vs
+    settled restarts. Time to armed runs from the last change of loco name or controller list to a model for the
+    final loco, with the settled restart it includes loco_settle_time.
+    """
+    for label, sequence in sorted(LOADING_SEQUENCES.items()):
+        names = [loco_name for _, loco_name, _ in sequence]
+        changes = sum(1 for previous, current in zip(names, names[1:]) if previous != current)
+        immediate_ready = [ready for (_, loco_name, ready), previous in zip(sequence[1:], names) if loco_name != previous]
+
+        final_loco = names[-1]
+        scenario = conformance.Scenario(dsd.MODEL_MAPPING['.'.join(final_loco[:2])], '.'.join(final_loco[:2]))
+        fake = scenario.raildriver
+        fake.loco_name, fake.controllers_ready = sequence[0][1], sequence[0][2]
+        rebuilds = 0
+        armed_at = None
+        with mock.patch('dsd.machine.raildriver.RailDriver', lambda: fake), \
+                mock.patch('dsd.machine.sound.Beeper', conformance.FakeBeeper), \
+                mock.patch('dsd.machine.usb.USBReader', conformance.FakeUSBReader):
+            scenario.build()
+            start = scenario.clock.time()
+            events = list(sequence[1:])
+            while armed_at is None and scenario.clock.time() - start < 30:
+                while events and events[0][0] <= scenario.clock.time() - start:
+                    _, fake.loco_name, fake.controllers_ready = events.pop(0)
+                scenario.clock.advance(step)
+                if scenario.machine.needs_restart:
+                    scenario.machine.close()
+                    scenario.build(settle=False)
+                    rebuilds += 1
+                if not events and scenario.machine.model and scenario.machine.loco_name == final_loco:
+                    armed_at = scenario.clock.time() - start
+            scenario.machine.close()
+
+        print('{:20} restart on every change: {} rebuilds, {} armed before the controller list was ready'.format(
+            label, changes, sum(1 for ready in immediate_ready if not ready)))
+        print('{:20} settled restarts:        {} rebuilds, time to armed {:.1f}s'.format(
+            '', rebuilds, armed_at - sequence[-1][0]))
+
+
+def bench_checkpoint(saves=10000, model_name='Class66APDSDModel'):
+    """
+    Cost of a checkpoint for the thread making a transition, handing it to the writer thread vs writing it, and time
+    from DSDMachine construction to armed for a loco with a built-in DSD to isolate, afresh vs from a checkpoint.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        checkpoint_file = dsd.CheckpointFile(os.path.join(directory, 'dsd.checkpoint'))
+        checkpoint = dsd.Checkpoint('idle', None, ['RSC', 'Class66Pack02', 'Class 66'], model_name, time.time())
+        write_cost = timeit.timeit(functools.partial(checkpoint_file.write, checkpoint), number=saves) / saves
+        checkpoint_file.start()
+        save_cost = timeit.timeit(functools.partial(checkpoint_file.save, checkpoint), number=saves) / saves
+        print('checkpoint on the caller thread: save {:.2f} us, write {:.2f} us'.format(save_cost * 1e6,
+                                                                                       write_cost * 1e6))
+
+        fake = conformance.FakeRailDriver(['RSC', 'Class66Pack02', 'Class 66'],
+                                          conformance.controls_of(getattr(dsd.machine.models, model_name)),
+                                          dsd.VirtualClock(12 * 3600))
+        fake.values['Reverser'] = 1.0
+        with mock.patch('dsd.machine.raildriver.RailDriver', lambda: fake), \
+                mock.patch('dsd.machine.sound.Beeper', conformance.FakeBeeper), \
+                mock.patch('dsd.machine.usb.USBReader', conformance.FakeUSBReader):
+            for label in ('afresh', 'from checkpoint'):
+                checkpoint_file.write(checkpoint._replace(state='needs_depress', react_by=datetime.time(12, 0, 4),
+                                                          saved_at=time.time()))
+                start = time.time()
+                machine = dsd.DSDMachine(checkpoint=checkpoint_file if label != 'afresh' else None)
+                elapsed = time.time() - start
+                print('armed {:16} in {:8.1f} ms, {} until {}'.format(label, elapsed * 1e3, machine.model.state,
+                                                                   machine.model.react_by))
+                machine.close()
+        checkpoint_file.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def cpu_seconds():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def bench_standby(seconds=3.0, trials=200):
+    """
+    CPU used while no loco is active, by a machine without a model polled in a busy loop as dsd.__main__ used to do,
+    by that machine alone and by Standby, and Standby's detection latency for locos appearing at random times within
+    ten minutes.
+    """
+    fake = conformance.FakeRailDriver(None, [], dsd.VirtualClock(12 * 3600))
+    with mock.patch('dsd.machine.raildriver.RailDriver', lambda: fake), \
+            mock.patch('dsd.machine.sound.Beeper', conformance.FakeBeeper), \
+            mock.patch('dsd.machine.usb.USBReader', conformance.FakeUSBReader):
+        machine = dsd.DSDMachine()
+        start, cpu_start = time.time(), cpu_seconds()
+        while not machine.needs_restart and time.time() - start < seconds:
+            pass
+        busy_cpu = cpu_seconds() - cpu_start
+        cpu_start, ticks = cpu_seconds(), machine.raildriver_listener.iteration
+        machine.restart_requested.wait(seconds)
+        idle_cpu, ticks = cpu_seconds() - cpu_start, machine.raildriver_listener.iteration - ticks
+        machine.close()
+
+    stopped = threading.Event()
+    standby = dsd.Standby(raildriver_factory=lambda: fake)
+    thread = threading.Thread(target=standby.wait, args=(stopped,))
+    cpu_start = cpu_seconds()
+    thread.start()
+    time.sleep(seconds)
+    stopped.set()
+    thread.join()
+    standby_cpu = cpu_seconds() - cpu_start
+    print('busy loop and idle machine  {:6.2f}% CPU'.format(busy_cpu / seconds * 100))
+    print('idle machine                {:6.2f}% CPU  {:.0f} RailDriver polls/h'.format(
+        idle_cpu / seconds * 100, ticks / seconds * 3600))
+    print('standby                     {:6.2f}% CPU  {:.0f} RailDriver probes/h'.format(
+        standby_cpu / seconds * 100, standby.probes / seconds * 3600))
+
+    random.seed(0)
+    latencies, probes = [], []
+    for _ in range(trials):
+        clock = dsd.VirtualClock()
+        fake = conformance.FakeRailDriver(None, [], clock)
+        standby = dsd.Standby(raildriver_factory=lambda: fake, clock=clock)
+        found = []
+        thread = threading.Thread(target=lambda: found.append((standby.wait(), clock.time())))
+        thread.start()
+        clock.wait_for_sleepers(1)
+        appears_at = random.uniform(0, 600)
+        clock.advance(appears_at)
+        fake.loco_name = ['DTG', 'Class 55', 'Class 55 BR Blue']
+        while thread.is_alive():
+            clock.advance(0.01)
+        latencies.append(found[0][1] - appears_at)
+        probes.append(standby.probes / found[0][1] * 3600)
+    print('detection latency           {}  {:.0f} probes/h on the way'.format(
+        percentiles(latencies), sum(probes) / len(probes)))
+
+
+def bench_listener(controls=64, moving=4, ticks=2000):
+    """
+    Per-control callbacks through raildriver.events.Listener vs the vectorized dsd.Listener.
+    """
+    names = ['Control{}'.format(index) for index in range(controls)]
+    fired = []
+
+    def per_control_callback(new, old):
+        if old is not None and abs(new - old) > 0.1:
+            fired.append(1)
+
+    def make_raildriver_listener(fake):
+        listener = raildriver.events.Listener(fake, interval=0)
+        listener.subscribe(names)
+        for name in names:
+            getattr(listener, 'on_{}_change'.format(name.lower()))(per_control_callback)
+        return listener
+
+    def make_dsd_listener(fake, use_numpy):
+        listener = dsd.Listener(fake, interval=0, default_threshold=0.1, use_numpy=use_numpy)
+        listener.subscribe(names)
+        listener.on_activity(lambda changes: fired.append(1))
+        return listener
+
+    candidates = [
+        ('baseline (fake DLL only)', lambda fake: None),
+        ('raildriver.events.Listener', make_raildriver_listener),
+        ('dsd.Listener (python)', lambda fake: make_dsd_listener(fake, False)),
+    ]
+    if dsd.listener.numpy is not None:
+        candidates.append(('dsd.Listener (numpy)', lambda fake: make_dsd_listener(fake, True)))
+
+    for label, factory in candidates:
+        random.seed(0)
+        fake = FakeRailDriver(names)
+        listener = factory(fake)
+        del fired[:]
+
+        def tick():
+            fake.jitter(moving)
+            if listener:
+                listener._main_iteration()
+            else:
+                [fake.get_current_controller_value(name) for name in names]
+
+        elapsed = timeit.timeit(tick, number=ticks)
+        print('{:30} {:8.1f} us/tick {:6d} callbacks'.format(label, elapsed / ticks * 1e6, len(fired)))
+
+
+def bench_publisher(subscribers=100, frames=200, period=0.005):
+    """
+    Cost of one StatePublisher update for the publishing thread and delivery latency to every subscriber, plus the
+    cost of polling the shared memory status block.
+    """
+    port = 47247
+    listeners = [dsd.Subscriber(port=port) for _ in range(subscribers)]
+    publisher = dsd.StatePublisher(port=port, status_block='railworksdsd-bench-{}'.format(os.getpid()))
+    latencies, costs = [], []
+    done = threading.Event()
+
+    def receive():
+        sockets = dict((listener.socket, listener) for listener in listeners)
+        while not done.is_set():
+            for sock in select.select(list(sockets), [], [], 0.1)[0]:
+                frame = dsd.Frame.unpack(sock.recv(dsd.Frame.layout.size))
+                latencies.append(time.time() - frame.timestamp)
+
+    receiver = threading.Thread(target=receive)
+    receiver.start()
+    try:
+        for index in range(frames):
+            start = time.time()
+            publisher.publish_state(dsd.telemetry.STATES[index % len(dsd.telemetry.STATES)], None)
+            costs.append(time.time() - start)
+            time.sleep(period)
+        time.sleep(0.5)
+        done.set()
+        receiver.join()
+        reader = dsd.StatusBlock(publisher.status_block.memory.name, create=False)
+        read_cost = timeit.timeit(reader.read, number=10000) / 10000
+        reader.close()
+    finally:
+        done.set()
+        publisher.close()
+        for listener in listeners:
+            listener.close()
+
+    print('update (publishing thread)     {}'.format(percentiles(costs)))
+    print('delivery to {:3} subscribers    {}  {}/{} frames, {} dropped'.format(
+        subscribers, percentiles(latencies), len(latencies), frames * subscribers, publisher.dropped))
+    print('status block read              {:.2f} us'.format(read_cost * 1e6))
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or [name[6:] for name in sorted(globals()) if name.startswith('bench_')]:
+        print('== {}'.format(name))
+        globals()['bench_{}'.format(name)]()
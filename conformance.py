@@ -0,0 +1,334 @@
+"""
+Conformance matrix for every model in dsd.MODEL_MAPPING. Each model runs a scripted and a randomized driving scenario
+against a fake RailDriver and footpedal on a VirtualClock, models are checked in parallel in a process pool.
+
+    python conformance.py [--random-steps N] [--seed N] [--processes N] [model ...]
+"""
+import argparse
+import collections
+import multiprocessing
+import random
+import sys
+import threading
+import timeit
+import traceback
+
+import mock
+
+import dsd
+from dsd import machine_models as models
+
+
+EXPECTED_TRANSITIONS = frozenset([
+    ('inactive', 'needs_depress'),
+    ('needs_depress', 'idle'),
+    ('needs_depress', 'needs_depress'),
+    ('idle', 'needs_depress'),
+    ('idle', 'inactive'),
+])
+
+Result = collections.namedtuple('Result', 'model locos failures transitions tick_cost')
+"""
+Outcome for one model: failures is a list of messages, transitions a {(source, dest): count} dict and tick_cost the
+mean time in seconds of one listener tick with all the model's bindings.
+"""
+
+
+class FakeRailDriver(object):
+    """
+    RailDriver with a fixed set of controls whose time comes from a VirtualClock. Records every write. While
+    controllers_ready is False the controller list is empty, like while a scenario is still loading.
+    """
+
+    controllers_ready = True
+
+    def __init__(self, loco_name, controls, clock):
+        self.loco_name = loco_name
+        self.clock = clock
+        self.values = dict((name, 0.0) for name in controls)
+        self.writes = []
+
+    def get_controller_list(self):
+        return list(enumerate(sorted(self.values))) if self.controllers_ready else []
+
+    def get_current_controller_value(self, name):
+        if name not in self.values:
+            raise ValueError('Controller index not found')
+        return self.values[name]
+
+    def get_current_time(self):
+        return self.clock.time_of_day()
+
+    def get_loco_name(self):
+        return self.loco_name
+
+    def set_controller_value(self, name, value):
+        self.writes.append((name, value))
+        self.values[name] = value
+
+
+class FakeBeeper(object):
+    """
+    Silent Beeper. It never reports itself as running, so the watchdog leaves it alone, sounding tells whether it
+    would be beeping.
+    """
+
+    heartbeat = None
+    running = False
+    sounding = False
+
+    def __init__(self, clock=None):
+        pass
+
+    def abandon(self):
+        self.sounding = False
+
+    def start(self):
+        self.sounding = True
+
+    def stop(self):
+        self.sounding = False
+
+
+class FakeDevice(object):
+
+    def close(self):
+        pass
+
+    def is_alive(self):
+        return True
+
+
+class FakeUSBReader(dsd.USBReader):
+
+    def instantiate_device(self, vendor_id, product_id):
+        return FakeDevice()
+
+
+class TransitionCounter(object):
+    """
+    Stands in for TelemetryRecorder and counts transitions.
+    """
+
+    def __init__(self):
+        self.transitions = collections.defaultdict(int)
+
+    def record(self, *args, **kwargs):
+        pass
+
+    def record_deadline(self, state, react_by):
+        pass
+
+    def record_transition(self, previous_state, state):
+        self.transitions[(previous_state, state)] += 1
+
+
+def controls_of(model_class):
+    controls = set(model_class.important_controls or [])
+    controls.update(['Reverser', model_class.emergency_brake_control_name])
+    if issubclass(model_class, models.BuiltinDSDIsolationMixin):
+        controls.add(model_class.dsd_controller_name)
+    if issubclass(model_class, models.FauxControllerMovementMixin):
+        controls.add(model_class.faux_controller_name)
+    return controls
+
+
+class Scenario(object):
+    """
+    Drives one DSDMachine and checks invariants after every step.
+    """
+
+    settle = 1.0
+
+    def __init__(self, model_class, loco_key):
+        self.model_class = model_class
+        self.clock = dsd.VirtualClock(12 * 3600)
+        self.counter = TransitionCounter()
+        self.failures = []
+        self.raildriver = FakeRailDriver(loco_key.split('.', 1) + ['Loco'], controls_of(model_class), self.clock)
+        self.config = dsd.Config(dsd.DEFAULTS._replace(listener_interval=0.5))
+        self.machine = None
+
+    def build(self, settle=True):
+        """
+        Builds the DSDMachine in a thread of its own, built-in DSD isolation sleeps on the clock advanced here.
+        """
+        built, errors = [], []
+
+        def build():
+            try:
+                built.append(dsd.DSDMachine(telemetry=self.counter, config=self.config, clock=self.clock))
+            except Exception:
+                errors.append(traceback.format_exc())
+
+        builder = threading.Thread(target=build)
+        builder.start()
+        while builder.is_alive():
+            if self.clock.is_asleep(builder):
+                self.clock.advance(0.1)
+            else:
+                builder.join(0.001)
+        if errors:
+            raise RuntimeError(errors[0])
+        self.machine = built[0]
+        if settle:
+            self.clock.advance(self.settle)  # let the listener take a first reading of the freshly subscribed controls
+
+    def check(self, condition, message):
+        if not condition:
+            self.failures.append('{} at {}: {}'.format(self.model_class.__name__, self.clock.time_of_day(), message))
+        return condition
+
+    def check_invariants(self, brakes_before):
+        model = self.machine.model
+        state = model.state
+        self.check(model.beeper.sounding == (state == dsd.NeedsDepress),
+                   'beeper {} in {}'.format('sounding' if model.beeper.sounding else 'silent', state))
+        self.check((model.react_by is None) == (state == dsd.Inactive),
+                   'react_by {} in {}'.format(model.react_by, state))
+        if self.brakes() > brakes_before:
+            self.check(state == dsd.NeedsDepress, 'emergency brake applied in {}'.format(state))
+
+    def brakes(self):
+        name = self.model_class.emergency_brake_control_name
+        return sum(1 for control, value in self.raildriver.writes if control == name and value == 1.0)
+
+    def move(self, control):
+        self.raildriver.values[control] = 1.0 - self.raildriver.values[control]
+
+    def step(self, action, seconds=None):
+        brakes_before = self.brakes()
+        action()
+        self.clock.advance(self.settle if seconds is None else seconds)
+        self.check_invariants(brakes_before)
+
+    def run_scripted(self):
+        machine = self.machine
+        model = machine.model
+        settings = model.settings
+        controls = [control for control in model.important_controls if control != 'Reverser']
+
+        subscribed = machine.raildriver_listener.subscribed_fields
+        self.check(set(model.important_controls) <= set(subscribed), 'important controls not all subscribed')
+        self.check('Reverser' in subscribed, 'Reverser not subscribed, reverser changes are never seen')
+        if isinstance(model, models.BuiltinDSDIsolationMixin):
+            self.check((model.dsd_controller_name, model.dsd_controller_value) in self.raildriver.writes,
+                       'built-in DSD {} was not isolated'.format(model.dsd_controller_name))
+        self.check(model.state == dsd.Inactive, 'initial state {}'.format(model.state))
+
+        self.step(lambda: self.move('Reverser'))
+        self.check(model.state == dsd.NeedsDepress, 'reverser out of neutral led to {}'.format(model.state))
+        self.step(lambda: machine.usb.execute_bindings('on_depress'))
+        self.check(model.state == dsd.Idle, 'depress led to {}'.format(model.state))
+
+        for control in controls:
+            self.clock.advance(settings.idle_timeout * 2 / 3)
+            self.step(lambda: self.move(control))
+            self.check(model.state == dsd.Idle, 'moving {} did not reset the idle timeout'.format(control))
+
+        self.step(lambda: None, settings.idle_timeout)
+        self.check(model.state == dsd.NeedsDepress, 'idle timeout led to {}'.format(model.state))
+        brakes = self.brakes()
+        self.step(lambda: None, settings.needs_depress_timeout)
+        self.check(self.brakes() > brakes, 'no emergency brake through {}'.format(
+            model.emergency_brake_control_name))
+
+        self.step(lambda: machine.usb.execute_bindings('on_depress'))
+        brakes = self.brakes()
+        self.step(lambda: machine.usb.execute_bindings('on_release'))
+        self.check(self.brakes() > brakes, 'no emergency brake on release')
+        self.step(lambda: machine.usb.execute_bindings('on_depress'))
+        self.step(lambda: self.move('Reverser'))
+        self.check(model.state == dsd.Inactive, 'reverser to neutral led to {}'.format(model.state))
+
+        missing = EXPECTED_TRANSITIONS - set(self.counter.transitions)
+        self.check(not missing, 'transitions never taken: {}'.format(sorted(missing)))
+
+    def run_randomized(self, steps, seed):
+        machine = self.machine
+        rng = random.Random(seed)
+        controls = list(self.machine.model.important_controls)
+        actions = [
+            lambda: self.move(rng.choice(controls)),
+            lambda: machine.usb.execute_bindings('on_depress'),
+            lambda: machine.usb.execute_bindings('on_release'),
+            lambda: self.move('Reverser'),
+            lambda: None,
+        ]
+        for _ in range(steps):
+            self.step(rng.choice(actions), rng.choice((self.settle, rng.uniform(1, 70))))
+
+    def tick_cost(self, ticks=200):
+        listener = self.machine.raildriver_listener
+        return timeit.timeit(listener._main_iteration, number=ticks) / ticks
+
+
+def check_model(args):
+    """
+    Runs both scenarios for a model class name, returns a Result. Takes a single tuple to work with Pool.map.
+    """
+    model_name, random_steps, seed = args
+    locos = sorted(key for key, model_class in dsd.MODEL_MAPPING.items() if model_class.__name__ == model_name)
+    model_class = getattr(models, model_name)
+    scenario = Scenario(model_class, locos[0] if locos[0] != 'Default' else 'Kuju.Default')
+    tick_cost = None
+    with mock.patch('dsd.machine.raildriver.RailDriver', lambda: scenario.raildriver), \
+            mock.patch('dsd.machine.sound.Beeper', FakeBeeper), \
+            mock.patch('dsd.machine.usb.USBReader', FakeUSBReader):
+        try:
+            scenario.build()
+            scenario.run_scripted()
+            scenario.run_randomized(random_steps, seed)
+            tick_cost = scenario.tick_cost()
+        except Exception:
+            scenario.failures.append('{}: {}'.format(model_name, traceback.format_exc()))
+        finally:
+            if scenario.machine:
+                scenario.machine.close()
+    return Result(model_name, locos, scenario.failures, dict(scenario.counter.transitions), tick_cost)
+
+
+def model_names():
+    return sorted(set(model_class.__name__ for model_class in dsd.MODEL_MAPPING.values()))
+
+
+def run(names=None, random_steps=100, seed=0, processes=None):
+    jobs = [(name, random_steps, seed) for name in names or model_names()]
+    if processes == 1:
+        return [check_model(job) for job in jobs]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(check_model, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def format_results(results):
+    lines = ['{:24} {:6} {:>11} {:>8}  {}'.format('model', 'result', 'transitions', 'us/tick', 'locos')]
+    for result in results:
+        covered = len(EXPECTED_TRANSITIONS & set(result.transitions))
+        lines.append('{:24} {:6} {:>5} ({}/{}) {:>8}  {}'.format(
+            result.model, 'FAIL' if result.failures else 'pass', sum(result.transitions.values()), covered,
+            len(EXPECTED_TRANSITIONS), '{:.1f}'.format(result.tick_cost * 1e6) if result.tick_cost else '-',
+            ', '.join(result.locos)))
+    for result in results:
+        lines.extend('  ' + failure for failure in result.failures)
+    return '\n'.join(lines)
+
+
+def __main__(argv=None):
+    parser = argparse.ArgumentParser(description='Check every DSD model against a fake RailDriver')
+    parser.add_argument('models', nargs='*', help='model class names, all models by default')
+    parser.add_argument('--random-steps', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    results = run(args.models, args.random_steps, args.seed, args.processes)
+    print(format_results(results))
+    return 1 if any(result.failures for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(__main__())
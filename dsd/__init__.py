@@ -1,30 +1,85 @@
 import logging
+import os
+import threading
 
+from dsd.checkpoint import *
+from dsd.clock import *
+from dsd.config import *
+from dsd.listener import *
 from dsd.machine import *
+from dsd.probe import *
+from dsd.publisher import *
+from dsd.simtime import *
+from dsd.standby import *
 from dsd.sound import *
+from dsd.telemetry import *
 from dsd.usb import *
+from dsd.usb_process import *
+from dsd.watchdog import *
+
+
+def configure_logging(path):
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(module)s:%(lineno)d %(message)s'))
+    root = logging.getLogger()
+    for previous_handler in root.handlers[:]:
+        root.removeHandler(previous_handler)
+        previous_handler.close()
+    root.addHandler(handler)
+    root.setLevel(logging.DEBUG)
 
 
 def __main__():
-    logging.basicConfig(
-        filename='dsd.log',
-        level=logging.DEBUG,
-        format='%(asctime)s %(module)s:%(lineno)d %(message)s'
-    )
+    watcher = ConfigWatcher('dsd.ini', model_names=set(model.__name__ for model in MODEL_MAPPING.values()))
+    configure_logging(watcher.config.settings.log_path)
+    log_path = [watcher.config.settings.log_path]
+    machine = None
+    machine_lock = threading.Lock()  # a config change must not interleave with a restart of the machine
+
+    def apply_config(config):
+        with machine_lock:
+            if config.settings.log_path != log_path[0]:
+                configure_logging(config.settings.log_path)
+                log_path[0] = config.settings.log_path
+            if machine:
+                machine.apply_config(config)
 
+    log_directory = os.path.dirname(os.path.abspath(watcher.config.settings.log_path))
+    recorder = TelemetryRecorder(os.path.join(log_directory, 'telemetry'))
+    publisher = StatePublisher()
+    publisher.start()
+    checkpoint = CheckpointFile(os.path.join(log_directory, 'dsd.checkpoint'))
+    checkpoint.start()
+    standby = Standby()
     try:
-        machine = DSDMachine()
+        watcher.on_change(apply_config)
+        watcher.start()
         while True:
-            while not machine.needs_restart:
+            standby.max_interval = watcher.config.settings.standby_max_interval
+            standby.wait()
+            with machine_lock:
+                machine = DSDMachine(telemetry=recorder, config=watcher.config, publisher=publisher,
+                                     checkpoint=checkpoint)
+            while not machine.restart_requested.wait(1.0):  # with a timeout so Ctrl+C gets through
                 pass
-            machine.close()
-            machine = DSDMachine()
+            with machine_lock:
+                machine.close()
+                machine = None
+            checkpoint.clear()  # a restart for another loco must not resume this one
     except KeyboardInterrupt:
-        machine.close()
+        if machine:
+            machine.close()
+        checkpoint.clear()
     except Exception:
         logging.exception('Unhandled exception.')
         try:
-            machine.close()
+            if machine:
+                machine.close()
         except Exception:
             pass
         raise
+    finally:
+        watcher.stop()
+        recorder.close()
+        publisher.close()
+        checkpoint.close()
@@ -0,0 +1,154 @@
+import collections
+import datetime
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from dsd import telemetry
+
+
+__all__ = (
+    'Checkpoint',
+    'CheckpointFile',
+)
+
+
+LOCO_SEPARATOR = '.:.'
+VERSION = 1
+
+
+class Checkpoint(collections.namedtuple('Checkpoint', 'state react_by loco_name model_name saved_at')):
+    """
+    What a restarted process needs to resume armed: the state, the deadline in simulator time as datetime.time or None,
+    the loco name as returned by RailDriver.get_loco_name, the model class name and the clock time it was saved at.
+    """
+
+    __slots__ = ()
+
+
+class CheckpointFile(object):
+    """
+    Keeps the latest Checkpoint in a small memory-mapped file, which survives a crash of the process.
+
+    save() only hands the checkpoint over to a writer thread and never waits for the file, a checkpoint saved while
+    the previous one is still being written replaces it. The file has two slots written alternately, each with a
+    sequence number and a CRC32, so a write cut short leaves the previous checkpoint readable.
+    """
+
+    layout = struct.Struct('<IIBBxxdd128s64s')
+    """
+    CRC32 of the rest of the slot, sequence number, version, state as an index of telemetry.STATES, saved_at, react_by
+    in seconds since midnight or -1, loco name and model name
+    """
+
+    dirty = None
+    file = None
+    lock = None
+    map = None
+
+    max_age = 60.0
+    """
+    Checkpoints older than this many seconds are not resumed from
+    """
+
+    path = None
+    pending = None
+    sequence = 0
+    stopped = None
+    thread = None
+    writes = 0
+
+    def __init__(self, path, max_age=None):
+        self.path = path
+        self.max_age = max_age or self.max_age
+        self.lock = threading.Lock()
+        self.dirty = threading.Event()
+        self.stopped = threading.Event()
+        size = self.layout.size * 2
+        self.file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        if os.path.getsize(path) < size:
+            self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.sequence = max([slot[0] for slot in self._read_slots()] or [0])
+
+    def _main_loop(self):
+        while not self.stopped.is_set():
+            self.dirty.wait()
+            self._write_pending()
+
+    def _read_slots(self):
+        slots = []
+        for offset in (0, self.layout.size):
+            data = self.map[offset:offset + self.layout.size]
+            fields = self.layout.unpack(data)
+            if fields[0] == zlib.crc32(data[4:]) & 0xffffffff and fields[2] == VERSION:
+                slots.append(fields[1:])
+        return slots
+
+    def _write_pending(self):
+        with self.lock:
+            checkpoint, self.pending = self.pending, None
+            self.dirty.clear()
+        if checkpoint is not None:
+            self.write(checkpoint)
+
+    def clear(self):
+        """
+        Forget the saved state, after a clean shutdown nothing should be resumed.
+        """
+        self.save(Checkpoint(None, None, None, '', 0.0))
+
+    def close(self):
+        self.stopped.set()
+        self.dirty.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+        self._write_pending()
+        self.map.close()
+        self.file.close()
+
+    def load(self):
+        """
+        The last saved Checkpoint, None if there is none.
+        """
+        slots = self._read_slots()
+        if not slots:
+            return None
+        sequence, _, state, saved_at, react_by, loco_name, model_name = max(slots)
+        if not state:
+            return None
+        if react_by >= 0:
+            react_by = (datetime.datetime.min + datetime.timedelta(seconds=react_by)).time()
+        else:
+            react_by = None
+        loco_name = loco_name.rstrip(b'\0').decode('utf-8', 'replace')
+        return Checkpoint(telemetry.STATES[state], react_by, loco_name.split(LOCO_SEPARATOR) if loco_name else None,
+                          model_name.rstrip(b'\0').decode('utf-8', 'replace'), saved_at)
+
+    def save(self, checkpoint):
+        with self.lock:
+            self.pending = checkpoint
+            self.dirty.set()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._main_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, checkpoint):
+        """
+        Write a checkpoint to the file right away, in the calling thread.
+        """
+        react_by = checkpoint.react_by
+        self.sequence += 1
+        data = self.layout.pack(
+            0, self.sequence, VERSION, telemetry.STATES.index(checkpoint.state), checkpoint.saved_at,
+            react_by.hour * 3600 + react_by.minute * 60 + react_by.second if react_by else -1,
+            LOCO_SEPARATOR.join(checkpoint.loco_name or []).encode('utf-8'), checkpoint.model_name.encode('utf-8'))
+        offset = self.layout.size * (self.sequence % 2)
+        self.map[offset:offset + self.layout.size] = struct.pack('<I', zlib.crc32(data[4:]) & 0xffffffff) + data[4:]
+        self.writes += 1
+        logging.debug('Checkpoint {} saved'.format(self.sequence))
@@ -0,0 +1,123 @@
+import datetime
+import threading
+import time
+
+
+__all__ = (
+    'Clock',
+    'VirtualClock',
+)
+
+
+class Clock(object):
+    """
+    Wall clock. Everything in dsd that waits or measures time does it through a Clock, so tests can swap in a
+    VirtualClock.
+    """
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def time(self):
+        return time.time()
+
+    def wait(self, event, timeout):
+        """
+        Wait until event is set or timeout seconds pass, returns True if the event was set.
+        """
+        return event.wait(timeout)
+
+
+class Sleeper(object):
+
+    __slots__ = ('thread', 'wake_at', 'woken')
+
+    def __init__(self, wake_at):
+        self.thread = threading.current_thread()
+        self.wake_at = wake_at
+        self.woken = threading.Event()
+
+
+class VirtualClock(Clock):
+    """
+    Clock that only moves when advance() is called, for deterministic tests of timeouts.
+
+    Threads calling sleep() or wait() block until the clock is advanced past their wake-up time. advance() wakes them
+    one at a time in wake-up order and waits until the woken thread sleeps again or exits, so a thread polling every
+    second runs exactly 3600 times when the clock is advanced by an hour, however long that takes in real time.
+    """
+
+    condition = None
+    now = 0.0
+    sleepers = None
+
+    def __init__(self, start=0.0):
+        self.now = start
+        self.condition = threading.Condition()
+        self.sleepers = []
+
+    def _is_asleep(self, thread):
+        return not thread.is_alive() or any(sleeper.thread is thread for sleeper in self.sleepers)
+
+    def is_asleep(self, thread):
+        """
+        True if thread is blocked on this clock or has exited.
+        """
+        with self.condition:
+            return self._is_asleep(thread)
+
+    def advance(self, seconds):
+        with self.condition:
+            target = self.now + seconds
+            while True:
+                due = [sleeper for sleeper in self.sleepers if sleeper.wake_at <= target]
+                if not due:
+                    break
+                sleeper = min(due, key=lambda sleeper: sleeper.wake_at)
+                self.sleepers.remove(sleeper)
+                self.now = max(self.now, sleeper.wake_at)
+                sleeper.woken.set()
+                while not self._is_asleep(sleeper.thread):
+                    self.condition.wait(0.01)
+            self.now = target
+
+    def sleep(self, seconds):
+        self.wait(None, seconds)
+
+    def time(self):
+        return self.now
+
+    def time_of_day(self):
+        """
+        The current time as datetime.time, for fake RailDriver.get_current_time implementations.
+        """
+        seconds = int(self.now) % 86400
+        return datetime.time(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+    def wait(self, event, timeout):
+        with self.condition:
+            sleeper = Sleeper(self.now + timeout)
+            self.sleepers.append(sleeper)
+            self.condition.notify_all()
+        while not sleeper.woken.wait(0.01 if event else None):
+            if event.is_set():
+                with self.condition:
+                    if sleeper in self.sleepers:
+                        self.sleepers.remove(sleeper)
+                    self.condition.notify_all()
+                return True
+        return bool(event and event.is_set())
+
+    def wait_for_sleepers(self, count, timeout=5.0):
+        """
+        Block until count threads are asleep on this clock, returns False if that did not happen within timeout real
+        seconds. Use it before advancing past the first tick of freshly started threads.
+        """
+        deadline = time.time() + timeout
+        with self.condition:
+            while len(self.sleepers) < count:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
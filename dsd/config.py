@@ -0,0 +1,271 @@
+import collections
+import logging
+import os
+import threading
+import time
+
+try:
+    import configparser
+except ImportError:  # pragma: no cover
+    import ConfigParser as configparser
+
+
+__all__ = (
+    'Config',
+    'ConfigWatcher',
+    'DEFAULTS',
+    'Settings',
+)
+
+
+GLOBAL_SECTION = 'dsd'
+
+GLOBAL_ONLY_FIELDS = (
+    'listener_interval',
+    'loco_settle_time',
+    'log_path',
+    'paused_listener_interval',
+    'pedal_process',
+    'product_id',
+    'sim_pause_timeout',
+    'standby_max_interval',
+    'vendor_id',
+    'watchdog_timeout',
+)
+"""
+Settings of the whole process that a model section can't override
+"""
+
+
+Settings = collections.namedtuple('Settings', [
+    'needs_depress_timeout',
+    'idle_timeout',
+    'control_threshold',
+    'listener_interval',
+    'vendor_id',
+    'product_id',
+    'log_path',
+    'pedal_process',
+    'watchdog_timeout',
+    'builtin_vigilance_period',
+    'loco_settle_time',
+    'sim_pause_timeout',
+    'paused_listener_interval',
+    'standby_max_interval',
+])
+"""
+Immutable snapshot of every runtime tunable. DSD timeouts and the vigilance period are in simulator seconds, the
+listener intervals, watchdog timeout, loco settle time, simulator pause timeout and standby probe interval in wall clock
+seconds.
+"""
+
+
+DEFAULTS = Settings(
+    needs_depress_timeout=6.0,
+    idle_timeout=60.0,
+    control_threshold=0.1,
+    listener_interval=0.1,
+    vendor_id=0x05f3,
+    product_id=0x00ff,
+    log_path='dsd.log',
+    pedal_process=False,
+    watchdog_timeout=2.0,
+    builtin_vigilance_period=60.0,
+    loco_settle_time=2.0,
+    sim_pause_timeout=3.0,
+    paused_listener_interval=1.0,
+    standby_max_interval=2.0,
+)
+
+
+def _boolean(value):
+    if value.lower() in ('1', 'yes', 'true', 'on'):
+        return True
+    if value.lower() in ('0', 'no', 'false', 'off'):
+        return False
+    raise ValueError(value)
+
+
+def _positive(value):
+    return value > 0
+
+
+def _non_negative(value):
+    return value >= 0
+
+
+def _usb_id(value):
+    return 0 <= value <= 0xffff
+
+
+FIELDS = {
+    'needs_depress_timeout': (float, _positive),
+    'idle_timeout': (float, _positive),
+    'control_threshold': (float, _non_negative),
+    'listener_interval': (float, _positive),
+    'vendor_id': (lambda value: int(value, 0), _usb_id),
+    'product_id': (lambda value: int(value, 0), _usb_id),
+    'log_path': (str, bool),
+    'pedal_process': (_boolean, lambda value: True),
+    'watchdog_timeout': (float, _positive),
+    'builtin_vigilance_period': (float, _positive),
+    'loco_settle_time': (float, _non_negative),
+    'sim_pause_timeout': (float, _positive),
+    'paused_listener_interval': (float, _positive),
+    'standby_max_interval': (float, _positive),
+}
+
+
+def parse_settings(items, base=DEFAULTS, section=GLOBAL_SECTION):
+    """
+    Builds Settings out of base and (name, raw string value) pairs. Raises ValueError on unknown or invalid values.
+    """
+    overrides = {}
+    for name, raw_value in items:
+        if name not in FIELDS:
+            raise ValueError('[{}] unknown setting {}'.format(section, name))
+        if section != GLOBAL_SECTION and name in GLOBAL_ONLY_FIELDS:
+            raise ValueError('[{}] {} can only be set in [{}]'.format(section, name, GLOBAL_SECTION))
+        convert, validate = FIELDS[name]
+        try:
+            value = convert(raw_value.strip())
+        except ValueError:
+            raise ValueError('[{}] {} = {} is not a valid value'.format(section, name, raw_value))
+        if not validate(value):
+            raise ValueError('[{}] {} = {} is out of range'.format(section, name, raw_value))
+        overrides[name] = value
+    settings = base._replace(**overrides)
+    for name in ('listener_interval', 'paused_listener_interval'):
+        if getattr(settings, name) >= settings.watchdog_timeout:
+            raise ValueError('[{}] {} = {} has to be shorter than watchdog_timeout = {}'.format(
+                section, name, getattr(settings, name), settings.watchdog_timeout))
+    return settings
+
+
+class Config(object):
+    """
+    Immutable parsed configuration: global settings and per-model overrides keyed by model class name.
+    """
+
+    __slots__ = ('settings', 'model_settings')
+
+    def __init__(self, settings=DEFAULTS, model_settings=()):
+        object.__setattr__(self, 'settings', settings)
+        object.__setattr__(self, 'model_settings', tuple(model_settings))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Config is immutable')
+
+    def __eq__(self, other):
+        return isinstance(other, Config) and (self.settings, self.model_settings) == (other.settings,
+                                                                                        other.model_settings)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def for_model(self, model_name):
+        for name, settings in self.model_settings:
+            if name == model_name:
+                return settings
+        return self.settings
+
+    @classmethod
+    def parse(cls, path, model_names=None):
+        """
+        Reads an INI file with the global [dsd] section and optional sections named after model classes, such as
+        [Class66APDSDModel], that override the global settings for that model only. If model_names are given, sections
+        not named after one of them are logged as they most likely contain a typo.
+        """
+        parser = configparser.RawConfigParser()
+        with open(path) as config_file:
+            if hasattr(parser, 'read_file'):
+                parser.read_file(config_file)
+            else:  # pragma: no cover
+                parser.readfp(config_file)
+
+        settings = DEFAULTS
+        if parser.has_section(GLOBAL_SECTION):
+            settings = parse_settings(parser.items(GLOBAL_SECTION), settings)
+        model_settings = [(section, parse_settings(parser.items(section), settings, section))
+                          for section in sorted(parser.sections()) if section != GLOBAL_SECTION]
+        for section, _ in model_settings:
+            if model_names is not None and section not in model_names:
+                logging.warning('[{}] in {} does not match any model and will never apply'.format(section, path))
+        return cls(settings, model_settings)
+
+
+class ConfigWatcher(object):
+    """
+    Polls a configuration file for changes and publishes a new Config snapshot when it parses and validates.
+
+    Parsing happens in the watcher thread, the current snapshot is swapped in a single assignment so readers always
+    see either the old or the new Config in full. A broken file is logged and ignored, the previous snapshot stays,
+    and so does the watcher if a binding fails to apply a snapshot.
+    """
+
+    bindings = None
+    config = None
+    model_names = None
+    mtime = None
+    path = None
+    poll_interval = 1.0
+    running = False
+    thread = None
+
+    def __init__(self, path, poll_interval=None, model_names=None):
+        self.path = path
+        self.poll_interval = poll_interval or self.poll_interval
+        self.model_names = model_names
+        self.bindings = []
+        self.config = Config()
+        self.check()
+
+    def _main_loop(self):
+        while self.running:
+            time.sleep(self.poll_interval)
+            self.check()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size
+
+    def check(self):
+        """
+        Reloads the file if it changed since the last check. Returns True if a new Config was applied.
+        """
+        mtime = self._stat()
+        if mtime == self.mtime:
+            return False
+        self.mtime = mtime
+
+        try:
+            config = Config.parse(self.path, self.model_names) if mtime else Config()
+        except (configparser.Error, EnvironmentError, ValueError):
+            logging.exception('Ignoring invalid configuration in {}'.format(self.path))
+            return False
+        if config == self.config:
+            return False
+
+        logging.debug('Applying configuration {}'.format(config.settings))
+        self.config = config
+        for binding in self.bindings:
+            try:
+                binding(config)
+            except Exception:
+                logging.exception('Applying configuration from {} failed'.format(self.path))
+        return True
+
+    def on_change(self, fun):
+        self.bindings.append(fun)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._main_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,258 @@
+import collections
+import logging
+import sys
+import threading
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+from dsd import clock as clocks
+
+
+__all__ = (
+    'Listener',
+)
+
+
+NaN = float('nan')
+
+
+class Listener(object):
+    """
+    Drop-in replacement for raildriver.events.Listener that keeps subscribed control values in a flat vector.
+
+    Every tick the whole vector is diffed against the values seen at the last reported movement, each control against
+    its own threshold. Controls that moved past their threshold are reported together in a single 'on_activity'
+    event, so drifting or jittering controls never fire as long as they stay within the threshold of their last
+    reported value.
+
+    Per-control 'on_<name>_change' and special field ('on_time_change', 'on_loconame_change') bindings work the same
+    way as in raildriver.events.Listener.
+    """
+
+    binding_indices = None
+    bindings = None
+    clock = None
+    default_threshold = 0.0
+    exc_info = None
+    interval = None
+    iteration = 0
+    lock = None
+    raildriver = None
+    running = False
+    stopped = None
+    subscribed_fields = None
+    thread = None
+    use_numpy = True
+
+    current_values = None
+    """
+    Control values read in the last tick, in the same order as subscribed_fields
+    """
+
+    previous_values = None
+    """
+    Control values read in the tick before the last one
+    """
+
+    reference_values = None
+    """
+    Control values at the time each control was last reported as moved
+    """
+
+    thresholds = None
+    """
+    Minimum distance from the reference value that counts as movement, per control
+    """
+
+    special_fields = (
+        ('!LocoName', 'get_loco_name'),
+        ('!Time', 'get_current_time'),
+    )
+
+    def __init__(self, raildriver, interval=0.5, default_threshold=0.0, use_numpy=True, clock=None):
+        self.raildriver = raildriver
+        self.interval = interval
+        self.clock = clock or clocks.Clock()
+        self.stopped = threading.Event()
+        self.default_threshold = default_threshold
+        self.use_numpy = use_numpy and numpy is not None
+        self.bindings = collections.defaultdict(list)
+        self.current_data = collections.defaultdict(lambda: None)
+        self.previous_data = collections.defaultdict(lambda: None)
+        self.lock = threading.Lock()
+        self.binding_indices = {}
+        self.subscribed_fields = []
+        self.thresholds = self._vector([])
+        self.current_values = self._vector([])
+        self.previous_values = self._vector([])
+        self.reference_values = self._vector([])
+
+    def __getattr__(self, item):
+        if item.startswith('on_') and item.endswith('_change'):
+            return lambda fun: self.bindings[item].append(fun)
+        raise AttributeError(item)
+
+    def _vector(self, values):
+        return numpy.array(values, dtype=float) if self.use_numpy else list(values)
+
+    def _diff(self, values):
+        """
+        Returns indices of controls that moved past their threshold, updating reference values for those.
+
+        Values are raw readings, NaN or None for a control that could not be read.
+        """
+        if self.use_numpy:
+            current = numpy.array(values, dtype=float)
+            self.previous_values, self.current_values = self.current_values, current
+            unknown = numpy.isnan(self.reference_values)
+            self.reference_values[unknown] = current[unknown]
+            with numpy.errstate(invalid='ignore'):
+                moved = numpy.flatnonzero(numpy.abs(current - self.reference_values) > self.thresholds)
+            self.reference_values[moved] = current[moved]
+            return moved.tolist()
+
+        values = [NaN if value is None else value for value in values]
+        self.previous_values, self.current_values = self.current_values, values
+        moved = []
+        for index, value in enumerate(values):
+            reference = self.reference_values[index]
+            if reference != reference:  # NaN, first reading
+                self.reference_values[index] = value
+            elif abs(value - reference) > self.thresholds[index]:
+                self.reference_values[index] = value
+                moved.append(index)
+        return moved
+
+    def _execute_bindings(self, type, *args, **kwargs):
+        for binding in self.bindings[type]:
+            binding(*args, **kwargs)
+
+    def _main_loop(self):
+        try:
+            while self.running:
+                self._main_iteration()
+                self.clock.wait(self.stopped, self.interval)
+        except Exception:
+            logging.exception('Listener stopped due to an unhandled exception.')
+            self.exc_info = sys.exc_info()
+            self.running = False
+
+    def _main_iteration(self):
+        self.iteration += 1
+        fields = self.subscribed_fields
+        read = self.raildriver.get_current_controller_value
+        readings = []
+        for field_name in fields:
+            try:
+                readings.append(read(field_name))
+            except ValueError:  # control not present in this loco
+                readings.append(NaN)
+
+        changes = []
+        reported = {}
+        with self.lock:
+            if fields is self.subscribed_fields:  # otherwise subscriptions changed mid-tick, skip the diff once
+                old_values = self.current_values
+                moved = self._diff(readings)
+                values = self.current_values
+                changes = [(binding_name, self.binding_indices[binding_name]) for binding_name in list(self.bindings)
+                           if binding_name in self.binding_indices]
+                reported = dict((self.subscribed_fields[index], float(values[index])) for index in moved)
+
+        for binding_name, index in changes:
+            new, old = float(values[index]), float(old_values[index])
+            if new != old and new == new and old == old:
+                self._execute_bindings(binding_name, new, old)
+
+        if reported:
+            self._execute_bindings('on_activity', reported)
+
+        self.previous_data = self.current_data.copy()
+        for field_name, method_name in self.special_fields:
+            value = getattr(self.raildriver, method_name)()
+            self.current_data[field_name] = value
+            if self.iteration > 1 and value != self.previous_data[field_name]:
+                binding_name = 'on_{}_change'.format(field_name[1:].lower())
+                self._execute_bindings(binding_name, value, self.previous_data[field_name])
+
+        self._execute_bindings('on_tick')
+
+    def clone(self):
+        """
+        A fresh, not yet started listener with the same subscriptions, thresholds, bindings and last seen values.
+
+        RailDriver calls are made outside of the lock, so this works even while this listener's thread is stuck in one.
+        """
+        listener = type(self)(self.raildriver, self.interval, self.default_threshold, self.use_numpy, self.clock)
+        with self.lock:
+            for binding_name, bindings in self.bindings.items():
+                listener.bindings[binding_name] = list(bindings)
+            listener.subscribe(self.subscribed_fields, dict(zip(self.subscribed_fields, self.thresholds)))
+            listener.current_values = self._vector(self.current_values)
+            listener.previous_values = self._vector(self.previous_values)
+            listener.reference_values = self._vector(self.reference_values)
+            listener.current_data.update(self.current_data)
+        return listener
+
+    def on_activity(self, fun):
+        """
+        Bind a callable that will receive a {control_name: new_value} dict of all controls that moved in a tick.
+        """
+        self.bindings['on_activity'].append(fun)
+
+    def on_tick(self, fun):
+        """
+        Bind a callable that will be called after every tick, used as a heartbeat.
+        """
+        self.bindings['on_tick'].append(fun)
+
+    def set_thresholds(self, thresholds):
+        """
+        Replace thresholds of already subscribed controls with values from a {control_name: threshold} dict.
+        """
+        with self.lock:
+            self.thresholds = self._vector([thresholds.get(name, current)
+                                            for name, current in zip(self.subscribed_fields, self.thresholds)])
+
+    def shift_reference(self, field_name, delta):
+        """
+        Account for a value this process wrote to a control itself, so it does not count towards movement. Only the
+        delta is applied, movements by the driver since the last reported one still count.
+        """
+        with self.lock:
+            if field_name in self.subscribed_fields:
+                self.reference_values[self.subscribed_fields.index(field_name)] += delta
+
+    def start(self):
+        self.running = True
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._main_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.stopped.set()
+
+    def subscribe(self, field_names, thresholds=None):
+        """
+        Add controls to the watched vector. Thresholds can be given as a {control_name: threshold} dict, controls not
+        listed there use default_threshold.
+        """
+        thresholds = thresholds or {}
+        with self.lock:
+            new_fields = [name for name in field_names if name not in self.subscribed_fields]
+            if not new_fields:
+                return
+            self.subscribed_fields = self.subscribed_fields + new_fields
+            self.binding_indices = dict(('on_{}_change'.format(name.lower()), index)
+                                        for index, name in enumerate(self.subscribed_fields))
+            padding = [NaN] * len(new_fields)
+            self.thresholds = self._vector(list(self.thresholds) + [thresholds.get(name, self.default_threshold)
+                                                                    for name in new_fields])
+            self.current_values = self._vector(list(self.current_values) + padding)
+            self.previous_values = self._vector(list(self.previous_values) + padding)
+            self.reference_values = self._vector(list(self.reference_values) + padding)
@@ -1,11 +1,21 @@
+import functools
 import logging
+import threading
 
 import raildriver
 import transitions
 
+from dsd import checkpoint as checkpoints
+from dsd import clock as clocks
+from dsd import config as configuration
+from dsd import listener
 from dsd import machine_models as models
+from dsd import simtime
 from dsd import sound
+from dsd import telemetry
 from dsd import usb
+from dsd import usb_process
+from dsd import watchdog
 
 
 __all__ = (
@@ -84,11 +94,48 @@ class DSDMachine(transitions.Machine):
     A threaded sound player
     """
 
+    checkpoint = None
+    """
+    Optional checkpoint.CheckpointFile that keeps state, deadline and loco for a restarted process to resume from
+    """
+
+    clock = None
+    """
+    clock.Clock shared by the listener, beeper, watchdog and model, a clock.VirtualClock in tests
+    """
+
+    config = None
+    """
+    config.Config snapshot currently applied, swapped as a whole by apply_config
+    """
+
+    loco_name = None
+    """
+    Name of the loco the machine was built for, as returned by RailDriver.get_loco_name
+    """
+
     needs_restart = False
     """
     True if instance is is no more operational and should be restarted.
     """
 
+    restart_requested = None
+    """
+    threading.Event set together with needs_restart, to wait on instead of polling the flag
+    """
+
+    pending_controllers = None
+    pending_loco = None
+    pending_since = None
+    """
+    Clock time of the last loco change that has not led to a restart yet, None if there is none
+    """
+
+    publisher = None
+    """
+    Optional publisher.StatePublisher that tells local tools about state, deadline and pedal changes
+    """
+
     raildriver = None
     """
     raildriver.RailDriver instance used to exchange control data with Train Simulator
@@ -96,7 +143,17 @@ class DSDMachine(transitions.Machine):
 
     raildriver_listener = None
     """
-    raildriver.events.Listener instance used to listen for control movements
+    listener.Listener instance used to listen for control movements
+    """
+
+    sim_time = None
+    """
+    simtime.SimTimeTracker that tells when the simulator is paused and how fast it runs
+    """
+
+    telemetry = None
+    """
+    Optional telemetry.TelemetryRecorder that gets every state transition, pedal edge and timeout
     """
 
     usb = None
@@ -104,15 +161,41 @@ class DSDMachine(transitions.Machine):
     usb.USB reader instance used to read data from a footpedal
     """
 
-    def __init__(self):
-        self.beeper = sound.Beeper()
-        self.raildriver = raildriver.RailDriver()
-        self.raildriver_listener = raildriver.events.Listener(self.raildriver, interval=0.1)
-        self.usb = usb.USBReader(0x05f3, 0x00ff)  # @TODO: provide support also for other devices
+    watchdog = None
+    """
+    watchdog.Watchdog instance that rebuilds the listener, footpedal or beeper if they stall
+    """
 
-        loco_name = self.raildriver.get_loco_name()
-        self.raildriver_listener.on_loconame_change(self.set_needs_restart_flag)
+    def __init__(self, telemetry=None, config=None, clock=None, publisher=None, checkpoint=None):
+        self.clock = clock or clocks.Clock()
+        self.checkpoint = checkpoint
+        self.config = config or configuration.Config()
+        self.telemetry = telemetry
+        self.publisher = publisher
+        self.restart_requested = threading.Event()
+        self.sim_time = simtime.SimTimeTracker(self.config.settings.sim_pause_timeout)
+        self.sim_time.on_pause(self.on_sim_pause)
+        self.sim_time.on_resume(self.on_sim_resume)
+        self.sim_time.on_rate_change(self.on_sim_rate_change)
+        self.watchdog = watchdog.Watchdog(self.config.settings.watchdog_timeout, clock=self.clock)
+        self.watchdog.watch('beeper', self.rebuild_beeper, is_active=lambda: self.beeper.running)
+        self.watchdog.watch('listener', self.rebuild_listener)
+        self.watchdog.watch('usb', self.rebuild_usb, probe=lambda: self.usb.is_alive())
+        self.beeper = self.open_beeper()
+        self.raildriver = raildriver.RailDriver()
+        self.raildriver_listener = listener.Listener(self.raildriver, interval=self.config.settings.listener_interval,
+                                                     clock=self.clock)
+        self.usb = self.open_usb(self.config.settings)
+
+        loco_name = self.loco_name = self.raildriver.get_loco_name()
+        self.raildriver_listener.on_loconame_change(self.on_loco_change)
+        self.raildriver_listener.on_tick(functools.partial(self.watchdog.beat, 'listener'))
+        self.raildriver_listener.on_tick(self.check_loco_change)
+        self.raildriver_listener.on_tick(self.track_sim_time)
+        if self.publisher:
+            self.raildriver_listener.on_time_change(lambda new, _: self.publisher.publish_time(new))
         self.raildriver_listener.start()
+        self.watchdog.start()
         if not loco_name:
             logging.debug('No active loco detected')
             return
@@ -120,11 +203,32 @@ class DSDMachine(transitions.Machine):
 
         self.init_model(loco_name)
 
+    def apply_config(self, config):
+        """
+        Apply a new configuration to a running machine without a restart. Only the footpedal is reopened and only
+        if its vendor or product id or the pedal_process option changed.
+        """
+        previous_settings = self.config.settings
+        self.config = config
+        settings = config.settings
+        self.sim_time.pause_timeout = settings.sim_pause_timeout
+        self.update_listener_interval()
+        self.watchdog.timeout = settings.watchdog_timeout
+        if ((settings.vendor_id, settings.product_id, settings.pedal_process) !=
+                (previous_settings.vendor_id, previous_settings.product_id, previous_settings.pedal_process)):
+            try:
+                self.reopen_usb(settings)
+            except Exception:
+                logging.exception('Keeping the current footpedal.')
+        if self.model:
+            self.model.apply_settings(config.for_model(type(self.model).__name__))
+
     def check_initial_reverser_state(self):
         if not self.model.is_reverser_in_neutral():
             self.set_state(NeedsDepress)
 
     def close(self, *args, **kwargs):
+        self.watchdog.stop()
         self.beeper.stop()
         self.raildriver_listener.stop()
         if self.raildriver_listener.thread:  # @TODO: this might be a bug in RD listener
@@ -134,6 +238,12 @@ class DSDMachine(transitions.Machine):
     def init_model(self, loco_name):
         model_class = MODEL_MAPPING.get('{}.{}'.format(*loco_name), MODEL_MAPPING['Default'])
         model = model_class(self.beeper, self.raildriver, self.raildriver_listener, self.usb)
+        model.settings = self.config.for_model(model_class.__name__)
+        model.telemetry = self.telemetry
+        model.clock = self.clock
+        model.sim_time = self.sim_time
+        resume_from = self.resumable_checkpoint(loco_name, model_class)
+        model.resumed = resume_from is not None
         logging.debug('Instantiated model {}'.format(repr(model)))
         super(DSDMachine, self).__init__(model,
                                          states=[Inactive, NeedsDepress, Idle],
@@ -147,18 +257,189 @@ class DSDMachine(transitions.Machine):
         self.add_transition('reverser_changed', 'idle', 'inactive', conditions='is_reverser_in_neutral')
         self.add_transition('timeout', 'idle', 'needs_depress')
         self.add_transition('timeout', 'needs_depress', 'needs_depress', before='emergency_brake')
-        self.usb.on_depress(self.model.device_depressed)
-        self.usb.on_release(self.model.device_released)
+        self.bind_usb(self.usb)
 
         self.model.bind_listener()
-        self.check_initial_reverser_state()
+        if self.publisher:
+            self.raildriver_listener.on_activity(lambda _: self.publisher.publish_deadline(self.model.react_by))
+        if self.checkpoint:
+            self.raildriver_listener.on_activity(lambda _: self.save_checkpoint())
+        if resume_from:
+            self.resume(resume_from)
+        else:
+            self.check_initial_reverser_state()
+
+    def bind_usb(self, usb_reader):
+        usb_reader.on_depress(self.model.device_depressed)
+        usb_reader.on_release(self.model.device_released)
+
+    def open_beeper(self):
+        beeper = sound.Beeper(self.clock)
+        beeper.heartbeat = functools.partial(self.watchdog.beat, 'beeper')
+        return beeper
+
+    def open_usb(self, settings):
+        if settings.pedal_process:
+            usb_reader = usb_process.ProcessUSBReader(settings.vendor_id, settings.product_id)
+        else:
+            usb_reader = usb.USBReader(settings.vendor_id, settings.product_id)
+        if self.telemetry:
+            usb_reader.on_depress(functools.partial(self.record_pedal_edge, telemetry.PedalDepress, usb_reader))
+            usb_reader.on_release(functools.partial(self.record_pedal_edge, telemetry.PedalRelease, usb_reader))
+        if self.publisher:
+            usb_reader.on_depress(functools.partial(self.publisher.publish_pedal, True))
+            usb_reader.on_release(functools.partial(self.publisher.publish_pedal, False))
+        return usb_reader
+
+    def record_pedal_edge(self, kind, usb_reader):
+        self.telemetry.record(kind, self.model.state if self.model else 'inactive', timestamp=usb_reader.edge_timestamp)
+
+    def rebuild_beeper(self):
+        """
+        Replace a stalled beeper. Its thread can't be joined, it is left behind to exit on its own.
+        """
+        self.beeper.abandon()
+        self.beeper = self.open_beeper()
+        if self.model:
+            self.model.beeper = self.beeper
+        self.beeper.start()
+
+    def rebuild_listener(self):
+        """
+        Replace a stalled or dead listener with a fresh one with the same subscriptions and bindings.
+        """
+        previous_listener = self.raildriver_listener
+        previous_listener.stop()
+        self.raildriver_listener = previous_listener.clone()
+        if self.model:
+            self.model.raildriver_listener = self.raildriver_listener
+        self.raildriver_listener.start()
 
-    def set_needs_restart_flag(self, _, __):
-        logging.debug('Needs restart due to loco change')
+    def rebuild_usb(self):
+        self.reopen_usb(self.config.settings)
+
+    def reopen_usb(self, settings):
+        logging.debug('Reopening footpedal vid={:#06x} pid={:#06x}'.format(settings.vendor_id, settings.product_id))
+        usb_reader = self.open_usb(settings)
+        if self.model:
+            self.bind_usb(usb_reader)
+            self.model.usb = usb_reader
+        previous_usb, self.usb = self.usb, usb_reader
+        try:
+            previous_usb.close()
+        except Exception:
+            logging.exception('Closing the previous footpedal failed.')
+
+    def check_loco_change(self):
+        """
+        Sets needs_restart once a loco change settled: no further change for settings.loco_settle_time seconds and the
+        new loco's controller list is non-empty and the same on two consecutive ticks. Flapping back to the loco the
+        machine was built for cancels the restart.
+        """
+        if self.pending_since is None or self.needs_restart:
+            return
+        if self.pending_loco == self.loco_name:
+            logging.debug('Loco changed back to {}, no restart needed'.format(self.loco_name))
+            self.pending_since = None
+            self.update_listener_interval()
+            return
+        if self.clock.time() - self.pending_since < self.config.settings.loco_settle_time:
+            return
+        if self.pending_loco:
+            controllers = self.raildriver.get_controller_list()
+            if not controllers or controllers != self.pending_controllers:
+                self.pending_controllers = controllers
+                return
+        logging.debug('Needs restart due to loco change to {}'.format(self.pending_loco))
         self.needs_restart = True
+        self.restart_requested.set()
+
+    def on_loco_change(self, new, _):
+        logging.debug('Loco changed to {}, waiting for it to settle'.format(new))
+        self.pending_loco = new
+        self.pending_controllers = None
+        self.pending_since = self.clock.time()
+        self.update_listener_interval()
+
+    def on_sim_pause(self):
+        """
+        Simulator time stopped, so do the timeouts. Silence the alarm and poll less often until it runs again.
+        """
+        self.update_listener_interval()
+        if self.model and self.model.state == NeedsDepress:
+            self.beeper.stop()
+
+    def on_sim_rate_change(self, rate, previous_rate):
+        if self.model:
+            self.model.rescale_react_by(rate / previous_rate)
+            if self.publisher:
+                self.publisher.publish_deadline(self.model.react_by)
+            self.save_checkpoint()
+
+    def on_sim_resume(self):
+        self.update_listener_interval()
+        if self.model and self.model.state == NeedsDepress:
+            self.beeper.start()
+
+    def resumable_checkpoint(self, loco_name, model_class):
+        """
+        The saved checkpoint if it is fresh and was armed on the same loco and model, None otherwise.
+        """
+        if not self.checkpoint:
+            return None
+        saved = self.checkpoint.load()
+        if not saved or saved.state == Inactive:
+            return None
+        if saved.loco_name != list(loco_name) or saved.model_name != model_class.__name__:
+            return None
+        if not 0 <= self.clock.time() - saved.saved_at <= self.checkpoint.max_age:
+            return None
+        return saved
+
+    def resume(self, saved):
+        """
+        Continue where a previous process left off: enter the saved state without running its callbacks, so the saved
+        deadline stays in place. An idle state with the reverser now in neutral is not resumed.
+        """
+        if saved.state == Idle and self.model.is_reverser_in_neutral():
+            return
+        logging.debug('Resuming {} until {}'.format(saved.state, saved.react_by))
+        super(DSDMachine, self).set_state(saved.state)
+        self.model.react_by = saved.react_by
+        if saved.state == NeedsDepress:
+            self.beeper.start()
+        if self.telemetry:
+            self.telemetry.record_transition(Inactive, saved.state)
+            self.telemetry.record_deadline(saved.state, saved.react_by)
+        if self.publisher:
+            self.publisher.publish_state(saved.state, saved.react_by)
+
+    def save_checkpoint(self):
+        if self.checkpoint and self.model:
+            self.checkpoint.save(checkpoints.Checkpoint(self.model.state, self.model.react_by, self.loco_name,
+                                                        type(self.model).__name__, self.clock.time()))
+
+    def track_sim_time(self):
+        self.sim_time.observe(self.raildriver_listener.current_data['!Time'], self.clock.time())
+
+    def update_listener_interval(self):
+        """
+        Poll at settings.paused_listener_interval while the simulator is paused, unless a loco change is waiting to
+        settle, at settings.listener_interval otherwise.
+        """
+        settings = self.config.settings
+        if self.sim_time.paused and self.pending_since is None:
+            self.raildriver_listener.interval = max(settings.paused_listener_interval, settings.listener_interval)
+        else:
+            self.raildriver_listener.interval = settings.listener_interval
 
     def set_state(self, state):
         previous_state = self.current_state
         super(DSDMachine, self).set_state(state)
+        if self.telemetry:
+            self.telemetry.record_transition(previous_state.name if previous_state else None, self.current_state.name)
         event_data = transitions.EventData(previous_state, None, self, self.model)
         self.current_state.enter(event_data)
+        if self.publisher:
+            self.publisher.publish_state(self.current_state.name, self.model.react_by)
+        self.save_checkpoint()
@@ -1,7 +1,8 @@
 import datetime
 import logging
-import random
-import time
+
+from dsd import clock as clocks
+from dsd import config
 
 
 class BaseDSDModel(object):
@@ -12,10 +13,30 @@ class BaseDSDModel(object):
     emergency_brake_control_name = 'EmergencyBrake'
     important_controls = None
 
+    important_control_thresholds = None
+    """
+    Per-control overrides of settings.control_threshold, such as {'ThrottleAndBrake': 0.05}.
+    """
+
     beeper = None
+    clock = clocks.Clock()
     raildriver = None
     raildriver_listener = None
     react_by = None
+
+    resumed = False
+    """
+    True if the model continues from a checkpoint of a previous process, the loco is then already set up
+    """
+
+    settings = config.DEFAULTS
+
+    sim_time = None
+    """
+    Optional simtime.SimTimeTracker, timeouts are stretched by the simulator rate so they last as long in real time
+    """
+
+    telemetry = None
     usb = None
 
     def __init__(self, beeper, raildriver, raildriver_listener, usb):
@@ -26,48 +47,78 @@ class BaseDSDModel(object):
 
     def bind_listener(self):
         if self.important_controls:
-            self.raildriver_listener.subscribe(self.important_controls)
-            for control_name in self.important_controls:
-                event_name = 'on_{}_change'.format(control_name.lower())
-                getattr(self.raildriver_listener, event_name)(self.on_important_control_change)
+            self.raildriver_listener.subscribe(self.important_controls, self.get_important_control_thresholds())
+            self.raildriver_listener.on_activity(self.on_important_controls_activity)
         self.raildriver_listener.on_reverser_change(self.reverser_changed)
         self.raildriver_listener.on_time_change(self.on_time_change)
 
+    def apply_settings(self, settings):
+        """
+        Swap in a new settings snapshot. Timeouts already running keep their deadline, new ones use the new values.
+        """
+        self.settings = settings
+        if self.important_controls:
+            self.raildriver_listener.set_thresholds(self.get_important_control_thresholds())
+
     def emergency_brake(self):
         self.raildriver.set_controller_value(self.emergency_brake_control_name, 1.0)
 
+    def get_important_control_thresholds(self):
+        thresholds = dict((control_name, self.settings.control_threshold) for control_name in self.important_controls)
+        thresholds.update(self.important_control_thresholds or {})
+        return thresholds
+
     def is_reverser_in_neutral(self, *args, **kwargs):
         reverser = self.raildriver.get_current_controller_value('Reverser')
         logging.debug('Reverser currently at to {}'.format(reverser))
         return -0.5 < reverser < 0.5
 
     def on_enter_needs_depress(self, *args, **kwargs):
-        self.beeper.start()
-
-        current_datetime = datetime.datetime.combine(datetime.datetime.today(), self.raildriver.get_current_time())
-        self.react_by = (current_datetime + datetime.timedelta(seconds=6)).time()
+        if not (self.sim_time and self.sim_time.paused):  # started on resume otherwise
+            self.beeper.start()
+        self.set_react_by(self.settings.needs_depress_timeout)
         logging.debug('on_enter_needs_depress: Timeout set to {}'.format(self.react_by))
 
     def on_enter_idle(self, *args, **kwargs):
         self.beeper.stop()
-
-        current_datetime = datetime.datetime.combine(datetime.datetime.today(), self.raildriver.get_current_time())
-        self.react_by = (current_datetime + datetime.timedelta(seconds=60)).time()
+        self.set_react_by(self.settings.idle_timeout)
         logging.debug('on_enter_idle: Timeout set to {}'.format(self.react_by))
 
     def on_enter_inactive(self, *args, **kwargs):
-        self.react_by = None
+        self.set_react_by(None)
         logging.debug('on_enter_inactive: Timeout set to {}'.format(self.react_by))
 
-    def on_important_control_change(self, new, old):
-        if old is None:
+    def on_important_controls_activity(self, changes):
+        if self.state == 'idle':
+            self.set_react_by(self.settings.idle_timeout)
+        logging.debug('Important controls {} moved. Timeout set to {}'.format(sorted(changes), self.react_by))
+
+    def rescale_react_by(self, factor):
+        """
+        Stretch the time left until a running timeout by factor, after the simulator rate changed.
+        """
+        if self.react_by is None:
             return
-        difference = abs(new - old)
-        if difference > 0.1:
+        current_datetime = datetime.datetime.combine(datetime.datetime.today(), self.raildriver.get_current_time())
+        react_by = datetime.datetime.combine(current_datetime.date(), self.react_by)
+        remaining = (react_by - current_datetime).total_seconds()
+        self.react_by = (current_datetime + datetime.timedelta(seconds=remaining % 86400 * factor)).time()
+        if self.telemetry:
+            self.telemetry.record_deadline(self.state, self.react_by)
+
+    def set_react_by(self, seconds):
+        """
+        Set the timeout to simulator time + seconds of real time or clear it if seconds is None.
+        """
+        if seconds is None:
+            self.react_by = None
+        else:
+            if self.sim_time:
+                seconds = self.sim_time.scale(seconds)
             current_datetime = datetime.datetime.combine(datetime.datetime.today(), self.raildriver.get_current_time())
-            if self.state == 'idle':
-                self.react_by = (current_datetime + datetime.timedelta(seconds=60)).time()
-            logging.debug('Important control moved. Timeout set to {}'.format(self.react_by))
+            self.react_by = (current_datetime + datetime.timedelta(seconds=seconds)).time()
+        if self.telemetry:
+            self.telemetry.record_deadline(self.state, self.react_by)
 
     def on_time_change(self, new, _):
         if self.react_by and new >= self.react_by:
@@ -82,17 +133,79 @@ class BuiltinDSDIsolationMixin(object):
     dsd_isolation_delay = 0
 
     def bind_listener(self):
-        time.sleep(self.dsd_isolation_delay)
+        if not self.resumed:  # the previous process already waited for the loco to be ready
+            self.clock.sleep(self.dsd_isolation_delay)
         self.raildriver.set_controller_value(self.dsd_controller_name, self.dsd_controller_value)
         super(BuiltinDSDIsolationMixin, self).bind_listener()
 
 
+class KeepAliveScheduler(object):
+    """
+    Decides when to move a controller to keep a built-in vigilance device quiet, with as few writes as possible.
+
+    A nudge is due margin seconds before period runs out since the last nudge or the last time the driver moved a
+    control. Nudges alternate direction, so the controller is back where the driver left it after every second one.
+    Times are simulator seconds since midnight.
+    """
+
+    direction = 1
+    last_reset = None
+    margin = 5.0
+    nudges = 0
+    step = .001
+
+    def __init__(self, margin=None, step=None):
+        self.margin = margin or self.margin
+        self.step = step or self.step
+
+    def next_delta(self, now, period):
+        """
+        Returns how much to move the controller by if a nudge is due, None otherwise. Without a known last reset
+        the built-in device could be about to trigger, so the first call always nudges.
+        """
+        if self.last_reset is not None and (now - self.last_reset) % 86400 < max(period - self.margin, 1):
+            return None
+        self.last_reset = now
+        self.nudges += 1
+        delta = self.step * self.direction
+        self.direction = -self.direction
+        return delta
+
+    def reset(self, now):
+        self.last_reset = now
+
+
+def seconds_since_midnight(value):
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
 class FauxControllerMovementMixin(object):
+    """
+    For locos whose built-in vigilance device can't be isolated: moves the faux controller back and forth by a tiny
+    step just before the built-in device would trigger after settings.builtin_vigilance_period, unless the driver
+    moved an important control in the meantime.
+    """
+
+    faux_controller_name = 'ThrottleAndBrake'
+    keepalive = None
+    last_time = None
+
+    def __init__(self, *args, **kwargs):
+        super(FauxControllerMovementMixin, self).__init__(*args, **kwargs)
+        self.keepalive = KeepAliveScheduler()
+
+    def on_important_controls_activity(self, changes):
+        if self.last_time is not None:
+            self.keepalive.reset(self.last_time)
+        super(FauxControllerMovementMixin, self).on_important_controls_activity(changes)
 
     def on_time_change(self, new, _):
-        current_tab = self.raildriver.get_current_controller_value('ThrottleAndBrake')
-        current_tab += .001 if random.randrange(0, 2) else -.001
-        self.raildriver.set_controller_value('ThrottleAndBrake', current_tab)
+        self.last_time = seconds_since_midnight(new)
+        delta = self.keepalive.next_delta(self.last_time, self.settings.builtin_vigilance_period)
+        if delta is not None:
+            current_value = self.raildriver.get_current_controller_value(self.faux_controller_name)
+            self.raildriver.set_controller_value(self.faux_controller_name, current_value + delta)
+            self.raildriver_listener.shift_reference(self.faux_controller_name, delta)
         super(FauxControllerMovementMixin, self).on_time_change(new, _)
 
 
@@ -109,7 +222,7 @@ class GenericDSDModel(BaseDSDModel):
 
     def bind_listener(self):
         if 'Bell' not in dict(self.raildriver.get_controller_list()).values():
-            self.important_controls.remove('Bell')
+            self.important_controls = [control for control in self.important_controls if control != 'Bell']
         super(GenericDSDModel, self).bind_listener()
 
 
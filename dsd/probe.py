@@ -0,0 +1,298 @@
+import argparse
+import collections
+import math
+import timeit
+
+import raildriver
+
+from dsd import config
+from dsd import machine
+from dsd import machine_models as models
+
+
+__all__ = (
+    'ControlProfile',
+    'EmulatedRailDriver',
+    'LatencyHistogram',
+)
+
+
+ControlProfile = collections.namedtuple('ControlProfile', 'index name get get_by_index set errors')
+"""
+Latencies of one control: get by name as dsd.Listener reads it, get by index and set, a LatencyHistogram each or None
+if not measured, and the number of calls that raised ValueError
+"""
+
+DUTY_CYCLE = 0.1
+"""
+Share of the listener interval a tick may spend in RailDriver calls
+"""
+
+INTERVAL_STEP = 0.05
+
+VIGILANCE_HINTS = ('dsd', 'vigil', 'deadman')
+
+
+class LatencyHistogram(object):
+    """
+    Call latencies in power of two buckets from 1 us up, the last bucket takes anything slower than max_seconds.
+    Percentiles are upper bucket bounds, capped at the slowest call seen.
+    """
+
+    max_seconds = 1.0
+
+    buckets = None
+    count = 0
+    maximum = 0.0
+    total = 0.0
+
+    def __init__(self):
+        self.buckets = [0] * (int(math.log(self.max_seconds * 1e6, 2)) + 2)
+
+    def add(self, seconds):
+        index = int(math.ceil(math.log(max(seconds * 1e6, 1), 2)))
+        self.buckets[min(index, len(self.buckets) - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, percent):
+        if not self.count:
+            return None
+        rank = max(int(round(percent / 100.0 * self.count)), 1)
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= rank:
+                return self.maximum if index == len(self.buckets) - 1 else min(2 ** index / 1e6, self.maximum)
+
+    def merge(self, other):
+        self.buckets = [mine + theirs for mine, theirs in zip(self.buckets, other.buckets)]
+        self.count += other.count
+        self.total += other.total
+        self.maximum = max(self.maximum, other.maximum)
+
+    def format(self, width=40):
+        lines = []
+        used = [index for index, bucket in enumerate(self.buckets) if bucket]
+        if not used:
+            return '  no samples'
+        top = max(self.buckets)
+        for index in range(used[0], used[-1] + 1):
+            lines.append('  <= {:>9}  {:{width}} {}'.format(format_seconds(2 ** index / 1e6),
+                                                            '#' * int(math.ceil(self.buckets[index] * width / top)),
+                                                            self.buckets[index], width=width))
+        return '\n'.join(lines)
+
+
+class EmulatedRailDriver(object):
+    """
+    Stand-in for raildriver.RailDriver with a fixed set of controls that each take latency seconds to read or write.
+    Controls given by name are looked up through get_controller_list() first, like raildriver.RailDriver does.
+    """
+
+    def __init__(self, controls, latency=0.0, loco_name=('Emulator', 'Loco', 'Emulated'), latencies=None):
+        self.controls = sorted(controls)
+        self.latency = latency
+        self.latencies = latencies or {}
+        self.loco_name = list(loco_name)
+        self.values = dict((name, 0.0) for name in self.controls)
+
+    def _call(self, latency):
+        until = timeit.default_timer() + latency
+        while timeit.default_timer() < until:
+            pass
+
+    def _name(self, index_or_name):
+        if isinstance(index_or_name, int):
+            if not 0 <= index_or_name < len(self.controls):
+                raise ValueError('Controller index not found')
+            return self.controls[index_or_name]
+        for index, name in self.get_controller_list():
+            if name == index_or_name:
+                return name
+        raise ValueError('Controller index not found')
+
+    @classmethod
+    def for_model(cls, model_class, latency=0.0):
+        controls = set(model_class.important_controls or [])
+        controls.update(['Reverser', model_class.emergency_brake_control_name, 'SpeedometerMPH'])
+        for name in ('dsd_controller_name', 'faux_controller_name'):
+            if getattr(model_class, name, None):
+                controls.add(getattr(model_class, name))
+        return cls(controls, latency)
+
+    def get_controller_list(self):
+        self._call(self.latency)
+        return list(enumerate(self.controls))
+
+    def get_current_controller_value(self, index_or_name):
+        name = self._name(index_or_name)
+        self._call(self.latencies.get(name, self.latency))
+        return self.values[name]
+
+    def get_current_time(self):
+        self._call(self.latency)
+        return None
+
+    def get_loco_name(self):
+        self._call(self.latency)
+        return self.loco_name
+
+    def set_controller_value(self, index_or_name, value):
+        name = self._name(index_or_name)
+        self._call(self.latencies.get(name, self.latency))
+        self.values[name] = value
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    if seconds < 1e-3:
+        return '{:.0f} us'.format(seconds * 1e6)
+    return '{:.2f} ms'.format(seconds * 1e3)
+
+
+def known_important_controls():
+    """
+    Every control an existing model treats as important.
+    """
+    names = set()
+    for model_class in set(machine.MODEL_MAPPING.values()):
+        names.update(model_class.important_controls or [])
+    return names
+
+
+def time_call(histogram, function, *args):
+    start = timeit.default_timer()
+    try:
+        function(*args)
+    finally:
+        histogram.add(timeit.default_timer() - start)
+
+
+def profile_controls(rail_driver, iterations=200, write=False):
+    """
+    Times every control of the active loco over iterations calls each. With write, the value read is written back to
+    time set_controller_value as well. Returns a list of ControlProfile.
+    """
+    profiles = []
+    for index, name in rail_driver.get_controller_list():
+        profile = ControlProfile(index, name, LatencyHistogram(), LatencyHistogram(),
+                                 LatencyHistogram() if write else None, 0)
+        errors = 0
+        for _ in range(iterations):
+            try:
+                time_call(profile.get, rail_driver.get_current_controller_value, name)
+                time_call(profile.get_by_index, rail_driver.get_current_controller_value, index)
+                if write:
+                    value = rail_driver.get_current_controller_value(index)
+                    time_call(profile.set, rail_driver.set_controller_value, index, value)
+            except ValueError:
+                errors += 1
+        profiles.append(profile._replace(errors=errors))
+    return profiles
+
+
+def profile_special_fields(rail_driver, iterations=200):
+    histograms = collections.OrderedDict()
+    for method_name in ('get_loco_name', 'get_current_time'):
+        histograms[method_name] = LatencyHistogram()
+        for _ in range(iterations):
+            time_call(histograms[method_name], getattr(rail_driver, method_name))
+    return histograms
+
+
+def suggest_important_controls(profiles):
+    known = known_important_controls()
+    return [profile.name for profile in profiles if profile.name in known and not profile.errors]
+
+
+def suggest_listener_interval(tick_cost, duty_cycle=DUTY_CYCLE):
+    """
+    The shortest listener_interval, in steps of INTERVAL_STEP, that keeps a tick of tick_cost seconds within duty_cycle
+    of the interval.
+    """
+    steps = max(int(math.ceil(tick_cost / duty_cycle / INTERVAL_STEP - 1e-9)), 1)
+    return round(steps * INTERVAL_STEP, 2)
+
+
+def format_report(loco_name, profiles, special, write):
+    lines = ['Loco: {}'.format('.'.join(loco_name)), '']
+    header = '{:>5} {:32} {:>10} {:>10} {:>10} {:>10}'.format('index', 'control', 'get mean', 'get p99', 'by index',
+                                                              'set mean')
+    lines.append(header)
+    all_gets = LatencyHistogram()
+    for profile in profiles:
+        lines.append('{:>5} {:32} {:>10} {:>10} {:>10} {:>10}{}'.format(
+            profile.index, profile.name[:32], format_seconds(profile.get.mean),
+            format_seconds(profile.get.percentile(99)), format_seconds(profile.get_by_index.mean),
+            format_seconds(profile.set.mean) if write else '-',
+            '  {} errors'.format(profile.errors) if profile.errors else ''))
+        all_gets.merge(profile.get)
+    for method_name, histogram in special.items():
+        lines.append('{:>5} {:32} {:>10} {:>10}'.format('', method_name, format_seconds(histogram.mean),
+                                                        format_seconds(histogram.percentile(99))))
+
+    lines.extend(['', 'get_current_controller_value by name, all controls:', all_gets.format()])
+    if write:
+        all_sets = LatencyHistogram()
+        for profile in profiles:
+            all_sets.merge(profile.set)
+        lines.extend(['', 'set_controller_value, all controls:', all_sets.format()])
+
+    important_controls = suggest_important_controls(profiles)
+    by_name = dict((profile.name, profile) for profile in profiles)
+    subscribed = (set(important_controls) | set(['Reverser'])) & set(by_name)
+    tick_cost = (sum(by_name[name].get.mean for name in subscribed) +
+                 sum(histogram.mean for histogram in special.values()))
+    lines.extend(['', 'Suggested model:', '', '    important_controls = ['])
+    lines.extend("        '{}',".format(name) for name in important_controls)
+    lines.append('    ]')
+    vigilance = [profile.name for profile in profiles
+                 if any(hint in profile.name.lower() for hint in VIGILANCE_HINTS)]
+    if vigilance:
+        lines.append('')
+        lines.append('    # built-in vigilance device? dsd_controller_name = one of {}'.format(', '.join(vigilance)))
+
+    interval = suggest_listener_interval(tick_cost)
+    lines.extend(['', 'A listener tick with these controls takes {}, listener_interval = {} keeps RailDriver calls '
+                      'under {:.0%} of it.'.format(format_seconds(tick_cost), interval, DUTY_CYCLE)])
+    if interval >= config.DEFAULTS.watchdog_timeout:
+        lines.append('Raise watchdog_timeout above {} as well.'.format(interval))
+    slow = [name for name in sorted(subscribed) if by_name[name].get.mean > 1.5 * by_name[name].get_by_index.mean]
+    if slow:
+        lines.append('Reading by name costs over 1.5 times as much as by index for {}.'.format(', '.join(slow)))
+    return '\n'.join(lines)
+
+
+def __main__(argv=None):
+    parser = argparse.ArgumentParser(description='Time RailDriver calls for the active loco and suggest model settings')
+    parser.add_argument('--iterations', type=int, default=200, help='calls per control and method')
+    parser.add_argument('--write', action='store_true',
+                        help='also time set_controller_value by writing back the value just read')
+    parser.add_argument('--emulate', metavar='MODEL',
+                        help='probe an emulated loco with the controls of a model class instead of Train Simulator')
+    parser.add_argument('--latency', type=float, default=0.0002, help='emulated latency of one call in seconds')
+    args = parser.parse_args(argv)
+
+    if args.emulate:
+        model_class = getattr(models, args.emulate, None)
+        if not isinstance(model_class, type) or not issubclass(model_class, models.BaseDSDModel):
+            parser.error('unknown model {}'.format(args.emulate))
+        rail_driver = EmulatedRailDriver.for_model(model_class, args.latency)
+    else:
+        rail_driver = raildriver.RailDriver()
+    loco_name = rail_driver.get_loco_name()
+    if not loco_name:
+        print('No active loco, start a scenario first.')
+        return 1
+
+    profiles = profile_controls(rail_driver, args.iterations, args.write)
+    special = profile_special_fields(rail_driver, args.iterations)
+    print(format_report(loco_name, profiles, special, args.write))
+    return 0
@@ -0,0 +1,260 @@
+import collections
+import logging
+import socket
+import struct
+import threading
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # pragma: no cover
+    shared_memory = None
+
+from dsd import clock as clocks
+from dsd import telemetry
+
+
+__all__ = (
+    'Frame',
+    'StatePublisher',
+    'StatusBlock',
+    'Subscriber',
+)
+
+
+State = 1
+"""
+DSDMachine changed state
+"""
+
+Pedal = 2
+Deadline = 3
+
+Countdown = 4
+"""
+Periodic repeat of the current status while a deadline is set
+"""
+
+KIND_NAMES = {
+    State: 'state',
+    Pedal: 'pedal',
+    Deadline: 'deadline',
+    Countdown: 'countdown',
+}
+
+PedalUnknown = 0
+PedalDepressed = 1
+PedalReleased = 2
+
+DEFAULT_GROUP = '239.255.77.77'
+DEFAULT_PORT = 47047
+STATUS_BLOCK_NAME = 'railworksdsd-status'
+VERSION = 1
+
+
+def _seconds(value):
+    if value is None:
+        return -1.0
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+class Frame(collections.namedtuple('Frame', 'version kind state pedal sequence timestamp sim_time react_by')):
+    """
+    Fixed-width status message, 32 bytes on the wire: the kind of change, state as an index of telemetry.STATES,
+    pedal position, a sequence number, the wall clock time it was published at and the simulator time and deadline in
+    seconds since midnight, -1 if unknown or not set.
+    """
+
+    __slots__ = ()
+
+    layout = struct.Struct('<BBBBIddd')
+
+    @property
+    def seconds_left(self):
+        if self.react_by < 0 or self.sim_time < 0:
+            return None
+        return (self.react_by - self.sim_time) % 86400
+
+    def pack(self):
+        return self.layout.pack(*self)
+
+    @classmethod
+    def unpack(cls, data, offset=0):
+        return cls._make(cls.layout.unpack_from(data, offset))
+
+
+EMPTY_FRAME = Frame(VERSION, 0, 0, PedalUnknown, 0, 0.0, -1.0, -1.0)
+
+
+class StatusBlock(object):
+    """
+    The latest Frame in a named multiprocessing.shared_memory block, for tools that would rather poll than listen.
+
+    Guarded by a sequence counter that is odd while the frame is being written: readers retry until they read the same
+    even counter before and after unpacking the frame.
+    """
+
+    header = struct.Struct('<I4x')
+
+    buffer = None
+    memory = None
+    owner = False
+    write_count = 0
+
+    def __init__(self, name=STATUS_BLOCK_NAME, create=True):
+        if shared_memory is None:
+            raise RuntimeError('Shared memory status block needs Python 3.8 or newer')
+        size = self.header.size + Frame.layout.size
+        self.owner = create
+        if create:
+            try:
+                self.memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+            except FileExistsError:  # left behind by a crashed run
+                self.memory = shared_memory.SharedMemory(name=name)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.buffer = self.memory.buf
+        if create:
+            self.write(EMPTY_FRAME)
+
+    def close(self):
+        self.buffer = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+    def read(self):
+        while True:
+            before = self.header.unpack_from(self.buffer, 0)[0]
+            if before % 2:
+                continue
+            frame = Frame.unpack(self.buffer, self.header.size)
+            if self.header.unpack_from(self.buffer, 0)[0] == before:
+                return frame
+
+    def write(self, frame):
+        self.write_count += 1
+        self.header.pack_into(self.buffer, 0, self.write_count)
+        frame.layout.pack_into(self.buffer, self.header.size, *frame)
+        self.write_count += 1
+        self.header.pack_into(self.buffer, 0, self.write_count)
+
+
+class StatePublisher(object):
+    """
+    Publishes DSDMachine state to local tools such as cab overlays: a Frame per change over UDP multicast that does
+    not leave this machine, optional periodic Countdown frames and a StatusBlock for polling.
+
+    Updates pack the frame and hand it to a non-blocking socket, a frame that does not fit the socket buffer is
+    dropped and counted, so they are safe to call from the RailDriver listener and HID threads.
+    """
+
+    address = None
+    clock = None
+    countdown_interval = 1.0
+    dropped = 0
+    frame = EMPTY_FRAME
+    lock = None
+    socket = None
+    status_block = None
+    stopped = None
+    thread = None
+
+    def __init__(self, group=DEFAULT_GROUP, port=DEFAULT_PORT, countdown_interval=None, status_block=STATUS_BLOCK_NAME,
+                 clock=None):
+        self.address = (group, port)
+        self.countdown_interval = self.countdown_interval if countdown_interval is None else countdown_interval
+        self.clock = clock or clocks.Clock()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 0)
+        self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton('127.0.0.1'))
+        self.socket.setblocking(False)
+        if status_block:
+            try:
+                self.status_block = StatusBlock(status_block)
+            except RuntimeError:
+                logging.warning('Status block disabled, shared memory is not available')
+
+    def _countdown_loop(self):
+        while not self.clock.wait(self.stopped, self.countdown_interval):
+            if self.frame.react_by >= 0:
+                self.update(Countdown)
+
+    def close(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+        self.socket.close()
+        if self.status_block:
+            self.status_block.close()
+
+    def publish_deadline(self, react_by):
+        """
+        Publish a new deadline, given as datetime.time or None. Unchanged deadlines are not published again.
+        """
+        if _seconds(react_by) != self.frame.react_by:
+            self.update(Deadline, react_by=_seconds(react_by))
+
+    def publish_pedal(self, depressed):
+        self.update(Pedal, pedal=PedalDepressed if depressed else PedalReleased)
+
+    def publish_state(self, state, react_by):
+        self.update(State, state=telemetry.STATES.index(state), react_by=_seconds(react_by))
+
+    def publish_time(self, sim_time):
+        """
+        Keep the simulator time in the status block up to date. Not sent on its own, it goes out with the next frame.
+        """
+        with self.lock:
+            self.frame = self.frame._replace(sim_time=_seconds(sim_time))
+            if self.status_block:
+                self.status_block.write(self.frame)
+
+    def start(self):
+        if self.countdown_interval:
+            self.thread = threading.Thread(target=self._countdown_loop)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def update(self, kind, **fields):
+        with self.lock:
+            self.frame = self.frame._replace(kind=kind, sequence=(self.frame.sequence + 1) % 2 ** 32,
+                                             timestamp=self.clock.time(), **fields)
+            if self.status_block:
+                self.status_block.write(self.frame)
+            try:
+                self.socket.sendto(self.frame.pack(), self.address)
+            except (socket.error, OSError):
+                self.dropped += 1
+        return self.frame
+
+
+class Subscriber(object):
+    """
+    Receives Frames published by a StatePublisher, for tools and tests.
+    """
+
+    socket = None
+
+    def __init__(self, group=DEFAULT_GROUP, port=DEFAULT_PORT):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(('', port))
+        self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                               socket.inet_aton(group) + socket.inet_aton('127.0.0.1'))
+
+    def close(self):
+        self.socket.close()
+
+    def receive(self, timeout=None):
+        """
+        The next Frame, None if none arrived within timeout seconds.
+        """
+        self.socket.settimeout(timeout)
+        try:
+            data = self.socket.recv(Frame.layout.size)
+        except socket.timeout:
+            return None
+        return Frame.unpack(data)
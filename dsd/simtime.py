@@ -0,0 +1,108 @@
+import collections
+import logging
+
+
+__all__ = (
+    'SimTimeTracker',
+)
+
+
+def seconds_of_day(value):
+    return value.hour * 3600 + value.minute * 60 + value.second + value.microsecond / 1e6
+
+
+class SimTimeTracker(object):
+    """
+    Follows simulator time against wall clock time to tell whether the simulator is paused and how fast it runs.
+
+    The simulator is paused once its time did not change for pause_timeout wall seconds, a loading scenario looks the
+    same. The rate is simulator seconds per wall second measured over the last window wall seconds, rates within
+    tolerance of real time count as 1.0 so that tick jitter does not rescale anything. Jumps faster than max_rate,
+    such as loading a save, restart the measurement instead.
+
+    Bindings: 'on_pause' and 'on_resume' without arguments, 'on_rate_change' with the new and the previous rate.
+    """
+
+    bindings = None
+    elapsed = 0.0
+    last_change = None
+    last_sim_time = None
+    max_rate = 16.0
+    pause_timeout = 3.0
+    paused = False
+    rate = 1.0
+    samples = None
+    tolerance = 0.1
+    window = 10.0
+
+    def __init__(self, pause_timeout=None, window=None):
+        self.pause_timeout = pause_timeout or self.pause_timeout
+        self.window = window or self.window
+        self.bindings = collections.defaultdict(list)
+        self.samples = collections.deque()
+
+    def _measure(self, now):
+        while len(self.samples) > 2 and self.samples[1][0] <= now - self.window:
+            self.samples.popleft()
+        (first_wall, first_elapsed), (last_wall, last_elapsed) = self.samples[0], self.samples[-1]
+        span = last_wall - first_wall
+        if span < self.window / 2:
+            return
+        rate = (last_elapsed - first_elapsed) / span
+        if abs(rate - 1.0) <= self.tolerance:
+            rate = 1.0
+        rate = min(max(rate, 1.0 / self.max_rate), self.max_rate)
+        if abs(rate - self.rate) > self.tolerance * self.rate:
+            previous_rate, self.rate = self.rate, rate
+            logging.debug('Simulator running at {:.2f}x real time'.format(rate))
+            self.execute_bindings('on_rate_change', rate, previous_rate)
+
+    def execute_bindings(self, type, *args, **kwargs):
+        for binding in self.bindings[type]:
+            binding(*args, **kwargs)
+
+    def observe(self, sim_time, now):
+        """
+        Feed the simulator time as datetime.time, None if unknown, read at wall clock time now. Call on every tick.
+        """
+        sim_time = None if sim_time is None else seconds_of_day(sim_time)
+        if sim_time is None or sim_time == self.last_sim_time:
+            if not self.paused and self.last_change is not None and now - self.last_change >= self.pause_timeout:
+                self.paused = True
+                logging.debug('Simulator paused')
+                self.execute_bindings('on_pause')
+            return
+
+        jumped = False
+        if self.last_sim_time is not None:
+            delta = (sim_time - self.last_sim_time) % 86400
+            jumped = delta > self.max_rate * max(now - self.last_change, 1.0)
+            self.elapsed += delta
+        self.last_sim_time = sim_time
+        self.last_change = now
+
+        if jumped or self.paused:
+            self.samples.clear()
+        if not jumped:  # after a jump the measurement starts again from the next regular change
+            self.samples.append((now, self.elapsed))
+        if self.paused:
+            self.paused = False
+            logging.debug('Simulator resumed')
+            self.execute_bindings('on_resume')
+        elif not jumped:
+            self._measure(now)
+
+    def on_pause(self, fun):
+        self.bindings['on_pause'].append(fun)
+
+    def on_rate_change(self, fun):
+        self.bindings['on_rate_change'].append(fun)
+
+    def on_resume(self, fun):
+        self.bindings['on_resume'].append(fun)
+
+    def scale(self, seconds):
+        """
+        Simulator seconds that take as long as seconds of real time at the current rate.
+        """
+        return seconds * self.rate
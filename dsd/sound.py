@@ -2,6 +2,8 @@ import os
 import threading
 import winsound
 
+from dsd import clock as clocks
+
 
 __all__ = (
     'Beeper',
@@ -10,13 +12,27 @@ __all__ = (
 
 class Beeper(object):
 
+    clock = None
     running = False
+    stopped = None
     thread = None
 
+    heartbeat = None
+    """
+    Optional callable run on every iteration of the beeper thread
+    """
+
     sound_beep = None
     sound_silence = None
 
-    def __init__(self):
+    superseded = False
+    """
+    Set when a new Beeper took over, the sound is then no longer ours to purge
+    """
+
+    def __init__(self, clock=None):
+        self.clock = clock or clocks.Clock()
+        self.stopped = threading.Event()
         sound_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'binary'))
         self.sound_beep = os.path.join(sound_dir, 'AP_66_cab_DSD_Alarm.wav')
         self.sound_silence = os.path.join(sound_dir, 'silence.wav')
@@ -24,17 +40,31 @@ class Beeper(object):
     def _main_loop(self):
         winsound.PlaySound(self.sound_beep, winsound.SND_ASYNC | winsound.SND_LOOP)
         while self.running:
-            pass
+            if self.heartbeat:
+                self.heartbeat()
+            self.clock.wait(self.stopped, 0.05)
+        if self.superseded:
+            return
         winsound.PlaySound(self.sound_silence, winsound.SND_PURGE)  # TODO: replace with silence / fadeout
 
+    def abandon(self):
+        """
+        Stop without joining or purging the sound, so a replacement Beeper can take over without being silenced.
+        """
+        self.superseded = True
+        self.running = False
+        self.stopped.set()
+
     def start(self):
         if self.running:
             pass
         self.running = True
+        self.stopped.clear()
         self.thread = threading.Thread(target=self._main_loop)
         self.thread.start()
 
     def stop(self):
         self.running = False
+        self.stopped.set()
         if self.thread:
             self.thread.join()
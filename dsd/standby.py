@@ -0,0 +1,68 @@
+import logging
+import threading
+
+import raildriver
+
+from dsd import clock as clocks
+
+
+__all__ = (
+    'Standby',
+)
+
+
+class Standby(object):
+    """
+    Waits for Train Simulator with an active loco without opening the footpedal or starting a listener.
+
+    The loco name is probed with an exponential backoff, from initial_interval up to max_interval seconds between
+    probes, so a loco is found at most max_interval seconds after it appeared however long the wait was. A RailDriver
+    that can't be created, because Train Simulator is not installed or not running, is retried on the same schedule.
+    """
+
+    clock = None
+    factor = 2.0
+    initial_interval = 0.25
+    max_interval = 2.0
+    probes = 0
+    raildriver = None
+    raildriver_factory = None
+
+    def __init__(self, max_interval=None, initial_interval=None, raildriver_factory=None, clock=None):
+        self.max_interval = max_interval or self.max_interval
+        self.initial_interval = min(initial_interval or self.initial_interval, self.max_interval)
+        self.raildriver_factory = raildriver_factory or raildriver.RailDriver
+        self.clock = clock or clocks.Clock()
+
+    def probe(self):
+        """
+        Returns the active loco name, None if there is none or Train Simulator can't be reached.
+        """
+        self.probes += 1
+        try:
+            if self.raildriver is None:
+                self.raildriver = self.raildriver_factory()
+            return self.raildriver.get_loco_name()
+        except EnvironmentError:
+            logging.debug('RailDriver not available', exc_info=True)
+            self.raildriver = None
+            return None
+
+    def wait(self, stopped=None):
+        """
+        Block until a loco is active and return its name. Returns None if the stopped event was set first.
+        """
+        stopped = stopped or threading.Event()
+        interval = self.initial_interval
+        logged = False
+        while not stopped.is_set():
+            loco_name = self.probe()
+            if loco_name:
+                return loco_name
+            if not logged:
+                logging.debug('No active loco, standing by')
+                logged = True
+            if self.clock.wait(stopped, interval):
+                break
+            interval = min(interval * self.factor, self.max_interval)
+        return None
@@ -0,0 +1,284 @@
+import argparse
+import array
+import glob
+import logging
+import os
+import struct
+import threading
+import time
+
+
+__all__ = (
+    'Record',
+    'ReactionTimeStats',
+    'SessionSummary',
+    'TelemetryRecorder',
+)
+
+
+Transition = 1
+"""
+DSDMachine changed state. Record.state is the new state, Record.value the index of the previous state.
+"""
+
+PedalDepress = 2
+PedalRelease = 3
+
+Deadline = 4
+"""
+react_by was set. Record.value is the deadline in simulator seconds since midnight or -1 if cleared.
+"""
+
+SessionStart = 5
+"""
+A TelemetryRecorder was opened. Record.value is the id of the recording process.
+"""
+
+KIND_NAMES = {
+    Transition: 'transition',
+    PedalDepress: 'pedal_depress',
+    PedalRelease: 'pedal_release',
+    Deadline: 'deadline',
+    SessionStart: 'session_start',
+}
+
+STATES = (None, 'inactive', 'needs_depress', 'idle')
+
+SEGMENT_PATTERN = 'segment-*.dsdt'
+
+
+class Record(object):
+    """
+    Single fixed-width telemetry record: wall clock timestamp, kind, current state and a kind-specific value.
+    """
+
+    __slots__ = ('timestamp', 'kind', 'state', 'value')
+
+    layout = struct.Struct('<dBBd')
+
+    def __init__(self, timestamp, kind, state, value=0.0):
+        self.timestamp = timestamp
+        self.kind = kind
+        self.state = state
+        self.value = value
+
+    def __repr__(self):
+        return '<Record {:.3f} {} {} {}>'.format(self.timestamp, KIND_NAMES.get(self.kind), STATES[self.state],
+                                                 self.value)
+
+    def pack(self):
+        return self.layout.pack(self.timestamp, self.kind, self.state, self.value)
+
+    @classmethod
+    def unpack(cls, data, offset=0):
+        return cls(*cls.layout.unpack_from(data, offset))
+
+
+class ReactionTimeStats(object):
+    """
+    Streaming reaction time statistics in constant memory.
+
+    Reaction times are counted in a fixed histogram of bucket_width wide buckets, percentiles are thus accurate to
+    bucket_width. Anything longer than max_seconds lands in the last bucket.
+    """
+
+    bucket_width = 0.01
+    max_seconds = 60
+
+    buckets = None
+    count = 0
+    maximum = None
+    minimum = None
+    total = 0.0
+
+    def __init__(self):
+        self.buckets = array.array('L', [0] * (int(self.max_seconds / self.bucket_width) + 1))
+
+    def add(self, seconds):
+        index = min(int(seconds / self.bucket_width), len(self.buckets) - 1)
+        self.buckets[max(index, 0)] += 1
+        self.count += 1
+        self.total += seconds
+        self.maximum = seconds if self.maximum is None else max(self.maximum, seconds)
+        self.minimum = seconds if self.minimum is None else min(self.minimum, seconds)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, percent):
+        if not self.count:
+            return None
+        rank = max(int(round(percent / 100.0 * self.count)), 1)
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= rank:
+                return min((index + 1) * self.bucket_width, self.maximum)
+
+
+class SessionSummary(object):
+    """
+    Aggregates a stream of records: counts per kind and transition and reaction times from the moment the pedal was
+    needed to the moment it was depressed. A pedal need never carries over into the next recording session.
+    """
+
+    emergency_brakes = 0
+    first_timestamp = None
+    last_timestamp = None
+    needed_since = None
+    records = 0
+    sessions = 0
+
+    kinds = None
+    reaction_times = None
+    transitions = None
+
+    def __init__(self):
+        self.kinds = dict((kind, 0) for kind in KIND_NAMES)
+        self.reaction_times = ReactionTimeStats()
+        self.transitions = {}
+
+    def feed(self, record):
+        self.records += 1
+        self.first_timestamp = self.first_timestamp or record.timestamp
+        self.last_timestamp = record.timestamp
+        self.kinds[record.kind] = self.kinds.get(record.kind, 0) + 1
+
+        if record.kind == SessionStart:
+            self.sessions += 1
+            self.needed_since = None
+        elif record.kind == Transition:
+            key = (STATES[int(record.value)], STATES[record.state])
+            self.transitions[key] = self.transitions.get(key, 0) + 1
+            if key == ('needs_depress', 'needs_depress'):
+                self.emergency_brakes += 1
+            if STATES[record.state] == 'needs_depress':
+                self.needed_since = self.needed_since or record.timestamp
+            elif STATES[record.state] == 'inactive':
+                self.needed_since = None
+        elif record.kind == PedalDepress and self.needed_since is not None:
+            self.reaction_times.add(record.timestamp - self.needed_since)
+            self.needed_since = None
+
+    def format(self):
+        lines = []
+        if self.records:
+            lines.append('Session: {} - {} ({:.0f} s), {} records in {} runs'.format(
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.first_timestamp)),
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.last_timestamp)),
+                self.last_timestamp - self.first_timestamp, self.records, self.sessions))
+        else:
+            lines.append('Session: no records')
+        for kind, name in sorted(KIND_NAMES.items()):
+            lines.append('  {:16} {}'.format(name, self.kinds[kind]))
+        for (source, dest), count in sorted(self.transitions.items(), key=lambda item: str(item[0])):
+            lines.append('  {:>13} -> {:13} {}'.format(str(source), str(dest), count))
+        lines.append('  emergency brakes {}'.format(self.emergency_brakes))
+
+        stats = self.reaction_times
+        if stats.count:
+            lines.append('Reaction time: n={} mean={:.2f}s min={:.2f}s max={:.2f}s'.format(
+                stats.count, stats.mean, stats.minimum, stats.maximum))
+            lines.append('  ' + ' '.join('p{}={:.2f}s'.format(percent, stats.percentile(percent))
+                                         for percent in (50, 90, 95, 99)))
+        else:
+            lines.append('Reaction time: no samples')
+        return '\n'.join(lines)
+
+
+class TelemetryRecorder(object):
+    """
+    Appends fixed-width records to segment files in a directory, starting a new segment every segment_records. Every
+    recorder starts with a SessionStart record, deadline records that do not change the deadline are skipped.
+
+    Safe to call from the RailDriver listener and HID threads at once. Keeps a live SessionSummary of what was
+    recorded so far.
+    """
+
+    directory = None
+    file = None
+    last_deadline = None
+    lock = None
+    segment_records = 65536
+    segment_written = 0
+    summary = None
+
+    def __init__(self, directory, segment_records=None):
+        self.directory = directory
+        self.segment_records = segment_records or self.segment_records
+        self.lock = threading.Lock()
+        self.summary = SessionSummary()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.record(SessionStart, None, os.getpid())
+
+    def _open_segment(self):
+        existing = sorted(glob.glob(os.path.join(self.directory, SEGMENT_PATTERN)))
+        number = int(os.path.basename(existing[-1])[8:-5]) + 1 if existing else 0
+        path = os.path.join(self.directory, 'segment-{:06d}.dsdt'.format(number))
+        logging.debug('Opening telemetry segment {}'.format(path))
+        self.file = open(path, 'ab')
+        self.segment_written = 0
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+    def flush(self):
+        with self.lock:
+            if self.file:
+                self.file.flush()
+
+    def record(self, kind, state, value=0.0, timestamp=None):
+        record = Record(timestamp or time.time(), kind, STATES.index(state), value)
+        with self.lock:
+            if self.file is None or self.segment_written >= self.segment_records:
+                if self.file:
+                    self.file.close()
+                self._open_segment()
+            self.file.write(record.pack())
+            self.segment_written += 1
+            self.summary.feed(record)
+        return record
+
+    def record_deadline(self, state, react_by):
+        value = react_by.hour * 3600 + react_by.minute * 60 + react_by.second if react_by else -1
+        if (state, value) == self.last_deadline:
+            return None
+        self.last_deadline = state, value
+        return self.record(Deadline, state, value)
+
+    def record_transition(self, previous_state, state):
+        return self.record(Transition, state, STATES.index(previous_state))
+
+
+def read_records(directory, chunk_records=4096):
+    """
+    Yields records from all segments in a directory in order, reading chunk_records at a time.
+    """
+    size = Record.layout.size
+    for path in sorted(glob.glob(os.path.join(directory, SEGMENT_PATTERN))):
+        with open(path, 'rb') as segment:
+            while True:
+                chunk = segment.read(size * chunk_records)
+                for offset in range(0, len(chunk) - size + 1, size):
+                    yield Record.unpack(chunk, offset)
+                if len(chunk) < size * chunk_records:
+                    break
+
+
+def __main__(argv=None):
+    parser = argparse.ArgumentParser(description='Summarize railworks-dsd session telemetry')
+    parser.add_argument('directory', nargs='?', default='telemetry')
+    parser.add_argument('--dump', action='store_true', help='print every record')
+    args = parser.parse_args(argv)
+
+    summary = SessionSummary()
+    for record in read_records(args.directory):
+        if args.dump:
+            print(repr(record))
+        summary.feed(record)
+    print(summary.format())
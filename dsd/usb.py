@@ -1,4 +1,5 @@
 import logging
+import time
 
 from pywinusb.hid import core as pywinusb
 
@@ -45,6 +46,13 @@ class AbstractDevice(object):
     def close(self):
         self.device.close()
 
+    def is_alive(self):
+        """
+        Pedals only send HID reports on edges, a silent pedal is the normal case and there is no report stream to
+        watch. Whether the device is still plugged in and its handle open is the closest available heartbeat.
+        """
+        return self.device.is_plugged() and self.device.is_opened()
+
 
 class InfinityInUSB2Device(AbstractDevice):
     """
@@ -69,28 +77,45 @@ class InfinityInUSB2Device(AbstractDevice):
         self.device.set_raw_data_handler(self.raw_data_handler)
 
     def raw_data_handler(self, rawdata):
+        timestamp = time.time()
         logging.debug('Received rawdata {}'.format(rawdata))
         depressed = rawdata[1] == 2
         released = rawdata[1] == 0
         if depressed:
-            self.usb_reader.execute_bindings('on_depress')
+            self.usb_reader.handle_edge('on_depress', timestamp)
         elif released:
-            self.usb_reader.execute_bindings('on_release')
+            self.usb_reader.handle_edge('on_release', timestamp)
+
+
+def get_device_class(vendor_id, product_id):
+    """
+    AbstractDevice descendant for a vendor and product id, raises ValueError for unsupported devices.
+    """
+    try:
+        return globals()[DEVICES[vendor_id][product_id]]
+    except KeyError:
+        raise ValueError('Device vid={} pid={} is not supported'.format(vendor_id, product_id))
 
 
 class USBReader(object):
 
-    bindings = {
-        'on_depress': [],
-        'on_release': [],
-    }
+    bindings = None
 
     device = None
     """
     One of AbstractDevice descendants
     """
 
+    edge_timestamp = None
+    """
+    time.time() at which the edge currently being handled was captured
+    """
+
     def __init__(self, vendor_id, product_id):
+        self.bindings = {
+            'on_depress': [],
+            'on_release': [],
+        }
         self.device = self.instantiate_device(vendor_id, product_id)
 
     def close(self):
@@ -100,12 +125,15 @@ class USBReader(object):
         for binding in self.bindings[type]:
             binding(*args, **kwargs)
 
+    def handle_edge(self, type, timestamp=None):
+        self.edge_timestamp = timestamp or time.time()
+        self.execute_bindings(type)
+
+    def is_alive(self):
+        return self.device.is_alive()
+
     def instantiate_device(self, vendor_id, product_id):
-        try:
-            class_name = DEVICES[vendor_id][product_id]
-            return globals()[class_name](self)
-        except KeyError:
-            raise ValueError('Device vid={} pid={} is not supported'.format(vendor_id, product_id))
+        return get_device_class(vendor_id, product_id)(self)
 
     def on_depress(self, fun):
         self.bindings['on_depress'].append(fun)
@@ -0,0 +1,211 @@
+import logging
+import multiprocessing
+import struct
+import threading
+import time
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # pragma: no cover
+    shared_memory = None
+
+from dsd import usb
+
+
+__all__ = (
+    'EdgeRing',
+    'ProcessUSBReader',
+)
+
+
+Depress = 1
+Release = 2
+
+EDGE_BINDINGS = {
+    Depress: 'on_depress',
+    Release: 'on_release',
+}
+
+
+class EdgeRing(object):
+    """
+    Single producer, single consumer ring of timestamped pedal edges in a multiprocessing.shared_memory block.
+
+    The header holds the number of edges ever written, each slot a time.time() timestamp and an edge type. The writer
+    fills a slot before publishing it by bumping the counter, the reader unpacks straight out of the shared buffer
+    and keeps its own read counter. If the reader falls more than capacity edges behind, the oldest are dropped.
+    """
+
+    header = struct.Struct('<Q56x')
+    slot = struct.Struct('<dB7x')
+
+    buffer = None
+    capacity = None
+    memory = None
+    owner = False
+    read_count = 0
+    write_count = 0
+
+    def __init__(self, capacity=256, name=None):
+        if shared_memory is None:
+            raise RuntimeError('Shared memory pedal ring needs Python 3.8 or newer')
+        self.capacity = capacity
+        self.owner = name is None
+        if self.owner:
+            self.memory = shared_memory.SharedMemory(create=True, size=self.header.size + self.slot.size * capacity)
+            self.header.pack_into(self.memory.buf, 0, 0)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.buffer = self.memory.buf
+        self.read_count = self.write_count = self.header.unpack_from(self.buffer, 0)[0]
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def close(self):
+        self.buffer = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+    def read(self):
+        """
+        Yields (timestamp, edge) for every edge published since the last read.
+        """
+        written = self.header.unpack_from(self.buffer, 0)[0]
+        if written - self.read_count > self.capacity:
+            logging.warning('Pedal ring overrun, dropped {} edges'.format(written - self.read_count - self.capacity))
+            self.read_count = written - self.capacity
+        while self.read_count < written:
+            offset = self.header.size + self.slot.size * (self.read_count % self.capacity)
+            yield self.slot.unpack_from(self.buffer, offset)
+            self.read_count += 1
+
+    def write(self, edge, timestamp):
+        offset = self.header.size + self.slot.size * (self.write_count % self.capacity)
+        self.slot.pack_into(self.buffer, offset, timestamp, edge)
+        self.write_count += 1
+        self.header.pack_into(self.buffer, 0, self.write_count)
+
+
+class RingWriter(object):
+    """
+    Stands in for USBReader in the pedal process, devices hand their edges to it and it publishes them to the ring.
+    """
+
+    def __init__(self, ring, semaphore):
+        self.ring = ring
+        self.semaphore = semaphore
+
+    def execute_bindings(self, type, *args, **kwargs):
+        self.handle_edge(type)
+
+    def handle_edge(self, type, timestamp=None):
+        edge = Depress if type == 'on_depress' else Release
+        self.ring.write(edge, timestamp or time.time())
+        self.semaphore.release()
+
+
+def open_device(usb_reader, vendor_id, product_id):
+    """
+    Default device factory for the pedal process: the same HID devices USBReader would open.
+    """
+    return usb.get_device_class(vendor_id, product_id)(usb_reader)
+
+
+def pedal_process_main(ring_name, capacity, semaphore, stop_event, connection, device_factory, vendor_id, product_id):
+    ring = EdgeRing(capacity, name=ring_name)
+    try:
+        device = device_factory(RingWriter(ring, semaphore), vendor_id, product_id)
+    except Exception as error:
+        connection.send(error)
+        ring.close()
+        return
+    connection.send(None)
+    try:
+        stop_event.wait()
+    finally:
+        device.close()
+        ring.close()
+
+
+class ProcessUSBReader(usb.USBReader):
+    """
+    USBReader that reads the footpedal in a separate process so HID callbacks never wait for the GIL of this one.
+
+    Edges are timestamped in the pedal process as they are captured and passed through an EdgeRing. A thread in this
+    process wakes up on a semaphore, reads new edges and executes the bindings just like USBReader does. The device
+    is opened in the pedal process, an error opening it is raised here.
+    """
+
+    capacity = 256
+    device_factory = None
+    open_timeout = 10.0
+    ring = None
+    running = False
+    semaphore = None
+    stop_event = None
+    thread = None
+
+    def __init__(self, vendor_id, product_id, device_factory=open_device, capacity=None):
+        self.device_factory = device_factory
+        self.capacity = capacity or self.capacity
+        super(ProcessUSBReader, self).__init__(vendor_id, product_id)
+
+    def _main_loop(self):
+        while self.running:
+            if not self.semaphore.acquire(timeout=0.5):
+                continue
+            for timestamp, edge in self.ring.read():
+                self.handle_edge(EDGE_BINDINGS[edge], timestamp)
+
+    def close(self):
+        self.running = False
+        self.stop_event.set()
+        self.device.join(timeout=5)
+        if self.device.is_alive():
+            self.device.terminate()
+        self.semaphore.release()
+        self.thread.join()
+        self.ring.close()
+
+    def instantiate_device(self, vendor_id, product_id):
+        """
+        Starts the pedal process, which takes the place of the device, and waits until it opened the device.
+        """
+        self.ring = EdgeRing(self.capacity)
+        self.semaphore = multiprocessing.Semaphore(0)
+        self.stop_event = multiprocessing.Event()
+        connection, child_connection = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=pedal_process_main, args=(
+            self.ring.name, self.capacity, self.semaphore, self.stop_event, child_connection, self.device_factory,
+            vendor_id, product_id))
+        process.daemon = True
+        process.start()
+        child_connection.close()
+        try:
+            if connection.poll(self.open_timeout):
+                error = connection.recv()
+            else:
+                error = IOError('Pedal process did not open vid={:#06x} pid={:#06x} in {}s'.format(
+                    vendor_id, product_id, self.open_timeout))
+        except EOFError:
+            error = IOError('Pedal process exited before opening vid={:#06x} pid={:#06x}'.format(
+                vendor_id, product_id))
+        finally:
+            connection.close()
+        if error is not None:
+            process.terminate()
+            process.join()
+            self.ring.close()
+            raise error
+
+        self.running = True
+        self.thread = threading.Thread(target=self._main_loop)
+        self.thread.daemon = True
+        self.thread.start()
+        return process
+
+    def is_alive(self):
+        return self.device.is_alive() and self.thread.is_alive()
@@ -0,0 +1,144 @@
+import logging
+import threading
+
+from dsd import clock as clocks
+
+
+__all__ = (
+    'Watchdog',
+)
+
+
+class Component(object):
+    """
+    A watched component: either heartbeat based (stalled when silent for longer than the timeout) or probe based
+    (stalled when the probe returns False).
+    """
+
+    detect_latency = None
+    """
+    How long the component had been silent when the last stall was detected
+    """
+
+    detected_at = None
+
+    failures = 0
+    """
+    Rebuilds attempted since the component was last healthy
+    """
+
+    is_active = None
+    last_beat = None
+    name = None
+    probe = None
+    recover = None
+    recovered = 0
+    recovering_since = None
+    retry_at = None
+
+    recovery_time = None
+    """
+    How long the last recovery took from detecting the stall to the first heartbeat or passing probe
+    """
+
+    def __init__(self, name, recover, probe=None, is_active=None, now=None):
+        self.name = name
+        self.recover = recover
+        self.probe = probe
+        self.is_active = is_active
+        self.last_beat = now
+
+
+class Watchdog(object):
+    """
+    Watches heartbeats of the listener, footpedal and beeper and rebuilds only the component that stalled.
+
+    A stall is detected at most timeout + interval after the last sign of life. A component that keeps failing, like
+    a footpedal process that dies right after every restart, is rebuilt with an exponential backoff: the n-th
+    consecutive attempt waits timeout * 2 ** (n - 1) seconds, at most max_backoff times the timeout.
+    """
+
+    clock = None
+    components = None
+    interval = None
+    max_backoff = 32
+    stopped = None
+    thread = None
+    timeout = 2.0
+
+    def __init__(self, timeout=None, interval=None, clock=None):
+        self.timeout = timeout or self.timeout
+        self.interval = interval
+        self.clock = clock or clocks.Clock()
+        self.components = {}
+        self.stopped = threading.Event()
+
+    def _is_healthy(self, component, now):
+        if component.probe:
+            return component.probe()
+        if component.recovering_since is not None:
+            return component.last_beat > component.recovering_since
+        return now - component.last_beat <= self.timeout
+
+    def _main_loop(self):
+        while not self.clock.wait(self.stopped, self.interval or self.timeout / 4.0):
+            self.check()
+
+    def beat(self, name):
+        self.components[name].last_beat = self.clock.time()
+
+    def check(self):
+        """
+        Recovers every stalled component. Returns names of the components that were recovered.
+        """
+        recovered = []
+        for name, component in sorted(self.components.items()):
+            now = self.clock.time()
+            if component.is_active and not component.is_active():
+                component.last_beat = now
+                continue
+
+            if self._is_healthy(component, now):
+                if component.probe:
+                    component.last_beat = now
+                if component.recovering_since is not None:
+                    component.failures = 0
+                    component.recovery_time = component.last_beat - component.recovering_since
+                    component.recovering_since = None
+                    logging.debug('Watchdog: {} recovered in {:.3f}s'.format(name, component.recovery_time))
+                continue
+
+            if component.recovering_since is not None and now < component.retry_at:
+                continue
+
+            component.detect_latency = now - component.last_beat
+            logging.warning('Watchdog: {} stalled for {:.3f}s, rebuilding'.format(name, component.detect_latency))
+            component.detected_at = component.recovering_since = now
+            component.failures += 1
+            component.retry_at = now + self.timeout * min(2 ** (component.failures - 1), self.max_backoff)
+            try:
+                component.recover()
+            except Exception:
+                logging.exception('Watchdog: rebuilding {} failed'.format(name))
+                continue
+            component.recovered += 1
+            recovered.append(name)
+        return recovered
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._main_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join(timeout=self.timeout)
+
+    def watch(self, name, recover, probe=None, is_active=None):
+        """
+        Start watching a component. Without a probe it has to call beat(name) more often than every timeout seconds
+        while is_active() is True.
+        """
+        self.components[name] = Component(name, recover, probe, is_active, self.clock.time())
@@ -28,7 +28,9 @@ setuptools.setup(
     classifiers=CLASSIFIERS,
     entry_points={
         'console_scripts': [
-            'railworksdsd = dsd:__main__'
+            'railworksdsd = dsd:__main__',
+            'railworksdsd-probe = dsd.probe:__main__',
+            'railworksdsd-telemetry = dsd.telemetry:__main__',
         ]
     },
     install_requires=open('requirements.txt').read(),
@@ -1,11 +1,50 @@
 import datetime
 import mock
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 import winsound
 
+import conformance
 import dsd
 
 
+def controller_value_getter(values):
+    """
+    Mimics RailDriver.get_current_controller_value which raises ValueError for controls the loco does not have
+    """
+    def get_current_controller_value(name):
+        if name not in values:
+            raise ValueError('Controller index not found')
+        return values[name]
+    return get_current_controller_value
+
+
+class FakeSimTime(object):
+    """
+    Mimics RailDriver.get_current_time of a simulator that runs at rate times the speed of clock, 0 when paused
+    """
+
+    def __init__(self, clock, start=None):
+        self.clock = clock
+        self.rate = 1.0
+        self.seconds = clock.time() if start is None else start
+        self.synced_at = clock.time()
+
+    def __call__(self):
+        self.seconds += (self.clock.time() - self.synced_at) * self.rate
+        self.synced_at = self.clock.time()
+        seconds = int(self.seconds) % 86400
+        return datetime.time(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+    def set_rate(self, rate):
+        self()
+        self.rate = rate
+
+
 @mock.patch('winsound.PlaySound')
 class BeeperTest(unittest.TestCase):
 
@@ -31,6 +70,170 @@ class BeeperTest(unittest.TestCase):
             mock.call(mock.ANY, winsound.SND_PURGE)
         ])
 
+    def test_abandon_does_not_purge(self, mock_playsound):
+        """
+        An abandoned beeper must not silence the sound of the beeper that replaced it
+        """
+        self.beeper.start()
+        self.beeper.abandon()
+        self.beeper.thread.join(timeout=10)
+        self.assertEqual(mock_playsound.mock_calls, [
+            mock.call(mock.ANY, winsound.SND_ASYNC | winsound.SND_LOOP),
+        ])
+
+
+class CheckpointTestCase(unittest.TestCase):
+
+    checkpoint = dsd.Checkpoint('idle', datetime.time(12, 31, 5), ['DTG', 'Class 55', 'Class 55 BR Blue'],
+                                'GenericDSDModel', 1000.0)
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'dsd.checkpoint')
+
+    def open(self):
+        checkpoint_file = dsd.CheckpointFile(self.path)
+        self.addCleanup(checkpoint_file.close)
+        return checkpoint_file
+
+    def test_roundtrip_across_processes(self):
+        self.assertIsNone(self.open().load())
+        checkpoint_file = self.open()
+        checkpoint_file.write(self.checkpoint._replace(state='needs_depress'))
+        checkpoint_file.write(self.checkpoint)
+        self.assertEqual(checkpoint_file.load(), self.checkpoint)
+        self.assertEqual(self.open().load(), self.checkpoint)
+
+    def test_torn_write_falls_back_to_previous_checkpoint(self):
+        checkpoint_file = self.open()
+        checkpoint_file.write(self.checkpoint._replace(state='needs_depress'))
+        checkpoint_file.write(self.checkpoint)
+        offset = checkpoint_file.layout.size * (checkpoint_file.sequence % 2)
+        checkpoint_file.map[offset + 20:offset + 28] = b'\xff' * 8
+        self.assertEqual(checkpoint_file.load().state, 'needs_depress')
+
+    def test_save_is_written_by_writer_thread(self):
+        checkpoint_file = self.open()
+        checkpoint_file.save(self.checkpoint)
+        self.assertIsNone(checkpoint_file.load())
+        checkpoint_file.start()
+        for _ in range(100):
+            if checkpoint_file.load():
+                break
+            time.sleep(0.01)
+        self.assertEqual(checkpoint_file.load(), self.checkpoint)
+        checkpoint_file.clear()
+        checkpoint_file.close()
+        self.assertIsNone(self.open().load())
+
+
+class VirtualClockTestCase(unittest.TestCase):
+
+    def test_advance_runs_sleeping_threads_in_order(self):
+        clock = dsd.VirtualClock()
+        ticks = []
+        stopped = threading.Event()
+
+        def poll(name, interval):
+            while not clock.wait(stopped, interval):
+                ticks.append((clock.time(), name))
+
+        threads = [threading.Thread(target=poll, args=('second', 1)), threading.Thread(target=poll, args=('minute', 60))]
+        for thread in threads:
+            thread.start()
+        self.assertTrue(clock.wait_for_sleepers(2))
+        clock.advance(3600)
+        stopped.set()
+        for thread in threads:
+            thread.join(timeout=10)
+        self.assertEqual(len(ticks), 3660)
+        self.assertEqual(ticks[59:61], [(60, 'minute'), (60, 'second')])  # ties wake in the order they fell asleep
+        self.assertEqual(clock.time_of_day(), datetime.time(1, 0))
+
+
+class ConfigTestCase(unittest.TestCase):
+
+    path = None
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'dsd.ini')
+
+    def write(self, content):
+        with open(self.path, 'w') as config_file:
+            config_file.write(content)
+        os.utime(self.path, (0, os.stat(self.path).st_mtime + 1))
+
+    def test_defaults_without_file(self):
+        watcher = dsd.ConfigWatcher(self.path)
+        self.assertEqual(watcher.config.settings, dsd.DEFAULTS)
+
+    def test_global_and_model_settings(self):
+        """
+        Model sections should inherit from the global section
+        """
+        self.write('[dsd]\nidle_timeout = 90\nvendor_id = 0x1234\n\n[Class66APDSDModel]\nneeds_depress_timeout = 3\n')
+        config = dsd.ConfigWatcher(self.path).config
+        self.assertEqual(config.settings.idle_timeout, 90)
+        self.assertEqual(config.settings.vendor_id, 0x1234)
+        self.assertEqual(config.settings.needs_depress_timeout, 6)
+        self.assertEqual(config.for_model('Class66APDSDModel').idle_timeout, 90)
+        self.assertEqual(config.for_model('Class66APDSDModel').needs_depress_timeout, 3)
+        self.assertIs(config.for_model('GenericDSDModel'), config.settings)
+        with self.assertRaises(AttributeError):
+            config.settings = dsd.DEFAULTS
+
+    def test_reload_on_change(self):
+        """
+        A changed file should be applied, an invalid one ignored
+        """
+        watcher = dsd.ConfigWatcher(self.path)
+        change_handler = mock.Mock()
+        watcher.on_change(change_handler)
+        self.assertFalse(watcher.check())
+
+        self.write('[dsd]\nidle_timeout = 30\n')
+        self.assertTrue(watcher.check())
+        change_handler.assert_called_once_with(watcher.config)
+        self.assertEqual(watcher.config.settings.idle_timeout, 30)
+
+        self.write('[dsd]\nidle_timeout = -1\n')
+        self.assertFalse(watcher.check())
+        self.write('[dsd]\nidle_timeoot = 1\n')
+        self.assertFalse(watcher.check())
+        self.assertEqual(watcher.config.settings.idle_timeout, 30)
+        self.assertEqual(change_handler.call_count, 1)
+
+    def test_model_section_cannot_override_global_settings(self):
+        self.write('[dsd]\nidle_timeout = 30\n\n[Class66APDSDModel]\nvendor_id = 0x1234\n')
+        with self.assertRaises(ValueError):
+            dsd.Config.parse(self.path)
+
+    @mock.patch('dsd.config.logging')
+    def test_unknown_model_section_warns(self, mock_logging):
+        self.write('[Class66APDSDModle]\nidle_timeout = 30\n')
+        dsd.Config.parse(self.path, model_names={'Class66APDSDModel'})
+        self.assertEqual(mock_logging.warning.call_count, 1)
+
+    def test_failing_binding_does_not_stop_others(self):
+        watcher = dsd.ConfigWatcher(self.path)
+        change_handler = mock.Mock()
+        watcher.on_change(mock.Mock(side_effect=RuntimeError))
+        watcher.on_change(change_handler)
+        self.write('[dsd]\nidle_timeout = 30\n')
+        self.assertTrue(watcher.check())
+        change_handler.assert_called_once_with(watcher.config)
+
+    def test_listener_interval_shorter_than_watchdog_timeout(self):
+        self.write('[dsd]\nlistener_interval = 2\nwatchdog_timeout = 1\n')
+        with self.assertRaises(ValueError):
+            dsd.Config.parse(self.path)
+        self.write('[dsd]\npaused_listener_interval = 3\n')
+        with self.assertRaises(ValueError):
+            dsd.Config.parse(self.path)
+
 
 @mock.patch('dsd.usb.pywinusb', mock.MagicMock())
 class DeviceTestCase(unittest.TestCase):
@@ -56,6 +259,184 @@ class DeviceTestCase(unittest.TestCase):
         self.assertEqual(release_handler.call_count, 1)
 
 
+class FakePedal(object):
+    """
+    Stands in for a HID device in the pedal process: presses and releases the pedal once.
+    """
+
+    def __init__(self, usb_reader, vendor_id, product_id):
+        if product_id != 0x00ff:
+            raise ValueError('Device vid={} pid={} is not supported'.format(vendor_id, product_id))
+        self.timer = threading.Timer(0.2, self.press, (usb_reader,))
+        self.timer.start()
+
+    def close(self):
+        self.timer.cancel()
+
+    def press(self, usb_reader):
+        usb_reader.handle_edge('on_depress', 1000.0)
+        usb_reader.handle_edge('on_release', 1001.0)
+
+
+class EdgeRingTestCase(unittest.TestCase):
+
+    def test_read_write(self):
+        ring = dsd.EdgeRing(capacity=4)
+        self.addCleanup(ring.close)
+        reader = dsd.EdgeRing(capacity=4, name=ring.name)
+        self.addCleanup(reader.close)
+        ring.write(dsd.usb_process.Depress, 1.0)
+        ring.write(dsd.usb_process.Release, 2.0)
+        self.assertEqual(list(reader.read()), [(1.0, dsd.usb_process.Depress), (2.0, dsd.usb_process.Release)])
+        self.assertEqual(list(reader.read()), [])
+
+    def test_overrun_drops_oldest(self):
+        ring = dsd.EdgeRing(capacity=4)
+        self.addCleanup(ring.close)
+        for timestamp in range(10):
+            ring.write(dsd.usb_process.Depress, timestamp)
+        self.assertEqual([timestamp for timestamp, _ in ring.read()], [6, 7, 8, 9])
+
+    def test_process_reader(self):
+        """
+        Edges captured in the pedal process should execute bindings here with their original timestamps
+        """
+        reader = dsd.ProcessUSBReader(0x05f3, 0x00ff, device_factory=FakePedal)
+        self.addCleanup(reader.close)
+        release_handler = mock.Mock(side_effect=lambda: timestamps.append(reader.edge_timestamp))
+        timestamps = []
+        reader.on_release(release_handler)
+        for _ in range(100):
+            if release_handler.called:
+                break
+            time.sleep(0.05)
+        self.assertEqual(timestamps, [1001.0])
+
+    def test_process_reader_open_error(self):
+        """
+        A device that can't be opened in the pedal process should raise here
+        """
+        with self.assertRaises(ValueError):
+            dsd.ProcessUSBReader(0x05f3, 0x00fe, device_factory=FakePedal)
+
+
+class ListenerTestCase(unittest.TestCase):
+
+    raildriver_controller_values = None
+    raildriver_mock = None
+
+    def setUp(self):
+        self.raildriver_controller_values = {}
+        self.raildriver_mock = mock.Mock()
+        self.raildriver_mock.get_current_controller_value.side_effect = controller_value_getter(
+            self.raildriver_controller_values)
+        self.raildriver_mock.get_current_time.return_value = datetime.time(12, 30)
+
+    def run_listener(self, use_numpy, ticks):
+        listener = dsd.Listener(self.raildriver_mock, default_threshold=0.1, use_numpy=use_numpy)
+        listener.subscribe(['Horn', 'Regulator', 'ThrottleAndBrake', 'Missing'], {'ThrottleAndBrake': 0.01})
+        activity_handler = mock.Mock()
+        listener.on_activity(activity_handler)
+        self.raildriver_controller_values.update({'Horn': 0, 'Regulator': 0, 'ThrottleAndBrake': 0.5})
+        for tick in ticks:
+            self.raildriver_controller_values.update(tick)
+            listener._main_iteration()
+        return activity_handler
+
+    def test_thresholds_and_hysteresis(self):
+        """
+        Small movements should accumulate against the last reported value and be reported together in one event.
+        """
+        ticks = [
+            {},
+            {'Regulator': 0.06, 'ThrottleAndBrake': 0.505},
+            {'Regulator': 0.12, 'ThrottleAndBrake': 0.495},
+            {'Horn': 1, 'ThrottleAndBrake': 0.52},
+        ]
+        for use_numpy in (False, True):
+            activity_handler = self.run_listener(use_numpy, ticks)
+            self.assertEqual(activity_handler.mock_calls, [
+                mock.call({'Regulator': 0.12}),
+                mock.call({'Horn': 1.0, 'ThrottleAndBrake': 0.52}),
+            ])
+
+    def test_per_control_bindings(self):
+        """
+        Per-control change bindings should behave like in raildriver.events.Listener
+        """
+        listener = dsd.Listener(self.raildriver_mock, default_threshold=0.1)
+        listener.subscribe(['Regulator'])
+        change_handler = mock.Mock()
+        listener.on_regulator_change(change_handler)
+        self.raildriver_controller_values['Regulator'] = 0
+        listener._main_iteration()
+        self.raildriver_controller_values['Regulator'] = 0.01
+        listener._main_iteration()
+        change_handler.assert_called_once_with(0.01, 0.0)
+
+    def test_own_writes_do_not_count_as_activity(self):
+        """
+        Faux controller movement should never be reported as activity, while movement by the driver still should
+        """
+        Model = type('Model', (dsd.machine.models.FauxControllerMovementMixin, FauxBaseModel), {})
+        self.raildriver_mock.set_controller_value.side_effect = self.raildriver_controller_values.__setitem__
+        for use_numpy in (False, True):
+            listener = dsd.Listener(self.raildriver_mock, use_numpy=use_numpy)
+            listener.subscribe(['ThrottleAndBrake'], {'ThrottleAndBrake': 0.01})
+            activity_handler = mock.Mock()
+            listener.on_activity(activity_handler)
+            model = Model()
+            model.keepalive = dsd.machine.models.KeepAliveScheduler(step=0.05)
+            model.raildriver, model.raildriver_listener = self.raildriver_mock, listener
+            self.raildriver_controller_values['ThrottleAndBrake'] = 0.5
+            for second in range(200):
+                listener._main_iteration()
+                model.on_time_change(datetime.time(12, 30 + second // 60, second % 60), None)
+            self.assertEqual(model.keepalive.nudges, 4)
+            self.assertFalse(activity_handler.called)
+            self.raildriver_controller_values['ThrottleAndBrake'] += 0.02
+            listener._main_iteration()
+            self.assertEqual(activity_handler.call_count, 1)
+
+
+class FauxBaseModel(object):
+
+    settings = dsd.DEFAULTS
+
+    def on_important_controls_activity(self, changes):
+        pass
+
+    def on_time_change(self, new, old):
+        pass
+
+
+class KeepAliveTestCase(unittest.TestCase):
+
+    def test_nudges_alternate_before_deadline(self):
+        scheduler = dsd.machine.models.KeepAliveScheduler(margin=5)
+        deltas = [(now, scheduler.next_delta(now, 60)) for now in range(3600)]
+        nudges = [(now, delta) for now, delta in deltas if delta is not None]
+        self.assertEqual([now for now, _ in nudges[:3]], [0, 55, 110])
+        self.assertEqual(len(nudges), 66)
+        self.assertAlmostEqual(sum(delta for _, delta in nudges), 0)
+
+    def test_driver_activity_postpones_nudge(self):
+        scheduler = dsd.machine.models.KeepAliveScheduler(margin=5)
+        nudges = []
+        for now in range(600):
+            if now % 30 == 0:
+                scheduler.reset(now)
+            if scheduler.next_delta(now, 60) is not None:
+                nudges.append(now)
+        self.assertEqual(nudges, [])
+
+    def test_midnight(self):
+        scheduler = dsd.machine.models.KeepAliveScheduler(margin=5)
+        scheduler.reset(86390)
+        self.assertIsNone(scheduler.next_delta(10, 60))
+        self.assertIsNotNone(scheduler.next_delta(45, 60))
+
+
 @mock.patch('dsd.usb.pywinusb', mock.MagicMock())
 class MachineTestCase(unittest.TestCase):
 
@@ -80,7 +461,8 @@ class MachineTestCase(unittest.TestCase):
             # this has to have all the controls listed in the 'Default' machine
             (10, 'AWSReset'), (20, 'Bell'), (30, 'Horn'), (40, 'Regulator'), (50, 'Reverser'), (60, 'TrainBrakeControl')
         ]
-        self.raildriver_mock.get_current_controller_value.side_effect = self.raildriver_controller_values.get
+        self.raildriver_mock.get_current_controller_value.side_effect = controller_value_getter(
+            self.raildriver_controller_values)
         self.raildriver_mock.get_current_time.return_value = datetime.time(12, 30)
         self.raildriver_mock.get_loco_name.return_value = ['DTG', 'Class 55', 'Class 55 BR Blue']
 
@@ -120,6 +502,20 @@ class MachineTestCase(unittest.TestCase):
         self.assertFalse(self.machine.needs_restart)
         self.assertIsInstance(self.machine.model, dsd.MODEL_MAPPING['Default'])
 
+    def test_generic_model_without_bell(self):
+        """
+        A loco without a bell should not take the bell away from the next loco using the same model
+        """
+        self.raildriver_mock.get_controller_list.return_value = [(10, 'AWSReset'), (50, 'Reverser')]
+        for _ in range(2):
+            machine = dsd.DSDMachine()
+            self.assertNotIn('Bell', machine.model.important_controls)
+            machine.close()
+        self.assertIn('Bell', dsd.machine.models.GenericDSDModel.important_controls)
+        self.raildriver_mock.get_controller_list.return_value = [(20, 'Bell')]
+        self.machine = dsd.DSDMachine()
+        self.assertIn('Bell', self.machine.model.important_controls)
+
     def test_initial_state_is_inactive(self):
         """
         Initially the DSD should be Inactive.
@@ -168,7 +564,7 @@ class MachineTestCase(unittest.TestCase):
         """
         self.machine = dsd.DSDMachine()
         self.assertIsNone(self.machine.model.react_by)
-        self.machine.raildriver_listener._execute_bindings('on_regulator_change', 0, 0.5)
+        self.machine.raildriver_listener._execute_bindings('on_activity', {'Regulator': 0.5})
         self.assertIsNone(self.machine.model.react_by)
 
     def test_needs_depress_enter_beep(self):
@@ -206,7 +602,7 @@ class MachineTestCase(unittest.TestCase):
         self.machine = dsd.DSDMachine()
         self.machine.set_state('needs_depress')
         self.assertEqual(self.machine.model.react_by, datetime.time(12, 30, 6))
-        self.machine.raildriver_listener._execute_bindings('on_regulator_change', 1, 0.5)
+        self.machine.raildriver_listener._execute_bindings('on_activity', {'Regulator': 0.5})
         self.assertEqual(self.machine.model.react_by, datetime.time(12, 30, 6))
 
     def test_idle_enter_no_beep(self):
@@ -232,7 +628,7 @@ class MachineTestCase(unittest.TestCase):
         self.machine = dsd.DSDMachine()
         self.machine.set_state('idle')
         self.raildriver_mock.get_current_time.return_value = datetime.time(12, 30, 30)
-        self.machine.raildriver_listener._execute_bindings('on_awsreset_change', 0, 1)
+        self.machine.raildriver_listener._execute_bindings('on_activity', {'AWSReset': 1})
         self.assertEqual(self.machine.model.react_by, datetime.time(12, 31, 30))
 
     def test_idle_bell_resets_timer(self):
@@ -242,7 +638,7 @@ class MachineTestCase(unittest.TestCase):
         self.machine = dsd.DSDMachine()
         self.machine.set_state('idle')
         self.raildriver_mock.get_current_time.return_value = datetime.time(12, 30, 30)
-        self.machine.raildriver_listener._execute_bindings('on_bell_change', 0, 1)
+        self.machine.raildriver_listener._execute_bindings('on_activity', {'Bell': 1})
         self.assertEqual(self.machine.model.react_by, datetime.time(12, 31, 30))
 
     def test_idle_horn_resets_timer(self):
@@ -252,7 +648,7 @@ class MachineTestCase(unittest.TestCase):
         self.machine = dsd.DSDMachine()
         self.machine.set_state('idle')
         self.raildriver_mock.get_current_time.return_value = datetime.time(12, 30, 30)
-        self.machine.raildriver_listener._execute_bindings('on_horn_change', 0, 1)
+        self.machine.raildriver_listener._execute_bindings('on_activity', {'Horn': 1})
         self.assertEqual(self.machine.model.react_by, datetime.time(12, 31, 30))
 
     def test_idle_regulator_resets_timer(self):
@@ -262,7 +658,7 @@ class MachineTestCase(unittest.TestCase):
         self.machine = dsd.DSDMachine()
         self.machine.set_state('idle')
         self.raildriver_mock.get_current_time.return_value = datetime.time(12, 30, 30)
-        self.machine.raildriver_listener._execute_bindings('on_regulator_change', 0, 1)
+        self.machine.raildriver_listener._execute_bindings('on_activity', {'Regulator': 1})
         self.assertEqual(self.machine.model.react_by, datetime.time(12, 31, 30))
 
     def test_idle_train_brake_control_resets_timer(self):
@@ -272,7 +668,7 @@ class MachineTestCase(unittest.TestCase):
         self.machine = dsd.DSDMachine()
         self.machine.set_state('idle')
         self.raildriver_mock.get_current_time.return_value = datetime.time(12, 30, 30)
-        self.machine.raildriver_listener._execute_bindings('on_trainbrakecontrol_change', 0, 1)
+        self.machine.raildriver_listener._execute_bindings('on_activity', {'TrainBrakeControl': 1})
         self.assertEqual(self.machine.model.react_by, datetime.time(12, 31, 30))
 
     def test_idle_pedal_released_fwd(self):
@@ -320,10 +716,584 @@ class MachineTestCase(unittest.TestCase):
 
     def test_reinitialize_model_on_loconame_change(self):
         """
-        When loco changes it's better to reinitialize the machine as controls might have changed
+        When loco changes it's better to reinitialize the machine as controls might have changed, but only once the
+        change settled
         """
-        self.machine = dsd.DSDMachine()
+        clock = dsd.VirtualClock()
+        self.machine = dsd.DSDMachine(clock=clock)
         self.assertTrue(self.machine.raildriver_listener.running)
-        self.raildriver_mock.get_loco_name.return_value = ['DTG', 'Class 55', 'Class 55 BR Blue']
-        self.machine.raildriver_listener._execute_bindings('on_loconame_change', 'Class 55 BR Blue', 'Class 43 FGW')
+        self.assertTrue(clock.wait_for_sleepers(2))
+        self.raildriver_mock.get_loco_name.return_value = ['DTG', 'Class 43', 'Class 43 FGW']
+        clock.advance(1)
+        self.assertFalse(self.machine.needs_restart)
+        clock.advance(1.5)
         self.assertTrue(self.machine.needs_restart)
+        self.assertTrue(self.machine.restart_requested.is_set())
+
+    def test_loco_change_flapping_back_is_ignored(self):
+        clock = dsd.VirtualClock()
+        self.machine = dsd.DSDMachine(clock=clock)
+        self.assertTrue(clock.wait_for_sleepers(2))
+        for loco_name in (None, ['DTG', 'Class 43', 'Class 43 FGW'], ['DTG', 'Class 55', 'Class 55 BR Blue']):
+            self.raildriver_mock.get_loco_name.return_value = loco_name
+            clock.advance(0.5)
+        clock.advance(10)
+        self.assertFalse(self.machine.needs_restart)
+
+    def test_loco_change_waits_for_controller_list(self):
+        clock = dsd.VirtualClock()
+        self.machine = dsd.DSDMachine(clock=clock)
+        self.assertTrue(clock.wait_for_sleepers(2))
+        controllers = self.raildriver_mock.get_controller_list.return_value
+        self.raildriver_mock.get_controller_list.return_value = []
+        self.raildriver_mock.get_loco_name.return_value = ['DTG', 'Class 43', 'Class 43 FGW']
+        clock.advance(10)
+        self.assertFalse(self.machine.needs_restart)
+        self.raildriver_mock.get_controller_list.return_value = controllers
+        clock.advance(0.1)
+        self.assertFalse(self.machine.needs_restart)
+        clock.advance(0.1)
+        self.assertTrue(self.machine.needs_restart)
+
+    def test_apply_config_without_restart(self):
+        """
+        New timeouts and thresholds should apply to the running machine, the footpedal only reopened on id change
+        """
+        self.machine = dsd.DSDMachine()
+        usb_reader = self.machine.usb
+        settings = dsd.DEFAULTS._replace(idle_timeout=30.0, control_threshold=0.5, listener_interval=0.2)
+        self.machine.apply_config(dsd.Config(settings))
+        self.assertIs(self.machine.usb, usb_reader)
+        self.assertEqual(self.machine.raildriver_listener.interval, 0.2)
+        self.assertEqual(list(self.machine.raildriver_listener.thresholds), [0.5] * 6)
+        self.machine.set_state('idle')
+        self.assertEqual(self.machine.model.react_by, datetime.time(12, 30, 30))
+        self.assertFalse(self.machine.needs_restart)
+
+        with mock.patch.dict('dsd.usb.DEVICES', {0x05f3: {0x00fe: 'InfinityInUSB2Device'}}):
+            self.machine.apply_config(dsd.Config(settings._replace(product_id=0x00fe)))
+        self.assertIsNot(self.machine.usb, usb_reader)
+        self.assertIs(self.machine.model.usb, self.machine.usb)
+        self.machine.usb.execute_bindings('on_release')
+        self.assertEqual(self.machine.current_state.name, 'idle')
+
+    def test_watchdog_rebuilds_hung_listener(self):
+        """
+        A listener stuck in a RailDriver call should be replaced by a new one with the same bindings
+        """
+        hang = threading.Event()
+        released = threading.Event()
+
+        def get_current_controller_value(name):
+            if hang.is_set() and threading.current_thread() is hung_thread[0]:
+                released.wait()
+            return self.raildriver_controller_values[name]
+
+        hung_thread = [None]
+        self.raildriver_mock.get_current_controller_value.side_effect = get_current_controller_value
+        self.machine = dsd.DSDMachine(config=dsd.Config(dsd.DEFAULTS._replace(watchdog_timeout=0.3)))
+        self.addCleanup(released.set)
+        listener = self.machine.raildriver_listener
+        hung_thread[0] = listener.thread
+        hang.set()
+        for _ in range(100):
+            if self.machine.raildriver_listener is not listener:
+                break
+            time.sleep(0.02)
+        self.assertIsNot(self.machine.raildriver_listener, listener)
+        self.assertIs(self.machine.model.raildriver_listener, self.machine.raildriver_listener)
+        self.assertEqual(self.machine.raildriver_listener.subscribed_fields, listener.subscribed_fields)
+
+    def test_watchdog_reopens_unplugged_pedal(self):
+        """
+        A footpedal that was unplugged should be reopened and bound to the model again
+        """
+        self.machine = dsd.DSDMachine()
+        usb_reader = self.machine.usb
+        usb_reader.device.device.is_plugged.return_value = False
+        self.assertEqual(self.machine.watchdog.check(), ['usb'])
+        self.assertIsNot(self.machine.usb, usb_reader)
+        self.assertIs(self.machine.model.usb, self.machine.usb)
+
+    def test_hour_of_driving_on_virtual_clock(self):
+        """
+        Driving an hour with the pedal held and the controls moving every 50 seconds should never time out, the
+        first minute without movement should, and so should the 6 seconds after it
+        """
+        clock = dsd.VirtualClock(12 * 3600 + 30 * 60)
+        self.raildriver_mock.get_current_time.side_effect = clock.time_of_day
+        self.raildriver_controller_values.update({'Regulator': 0})
+        self.machine = dsd.DSDMachine(config=dsd.Config(dsd.DEFAULTS._replace(listener_interval=1.0)), clock=clock)
+        self.assertTrue(clock.wait_for_sleepers(2))
+        self.machine.set_state('needs_depress')
+        self.machine.usb.execute_bindings('on_depress')
+        for minute in range(72):
+            self.raildriver_controller_values['Regulator'] = minute % 2
+            clock.advance(50)
+        self.assertEqual(self.machine.current_state.name, 'idle')
+        self.assertFalse(self.raildriver_mock.set_controller_value.called)
+
+        clock.advance(11)
+        self.assertEqual(self.machine.current_state.name, 'needs_depress')
+        self.assertFalse(self.raildriver_mock.set_controller_value.called)
+        clock.advance(6)
+        self.raildriver_mock.set_controller_value.assert_called_with('EmergencyBrake', 1)
+
+    def test_paused_and_accelerated_simulator(self):
+        """
+        A paused simulator silences the alarm and slows polling down without timing out, an accelerated one gets
+        timeouts that last as long in real time
+        """
+        clock = dsd.VirtualClock(12 * 3600)
+        sim_time = FakeSimTime(clock)
+        self.raildriver_mock.get_current_time.side_effect = sim_time
+        self.raildriver_controller_values.update({'Regulator': 0})
+        self.beeper_mock.running = False
+        settings = dsd.DEFAULTS._replace(listener_interval=0.5, paused_listener_interval=1.5)
+        self.machine = dsd.DSDMachine(config=dsd.Config(settings), clock=clock)
+        listener = self.machine.raildriver_listener
+        self.assertTrue(clock.wait_for_sleepers(2))
+        self.machine.set_state('needs_depress')
+        self.assertEqual(self.beeper_mock.start.call_count, 1)
+
+        sim_time.set_rate(0)
+        clock.advance(5)
+        self.assertTrue(self.machine.sim_time.paused)
+        self.assertEqual(listener.interval, 1.5)
+        self.assertTrue(self.beeper_mock.stop.called)
+        clock.advance(60)
+        self.assertEqual(self.machine.current_state.name, 'needs_depress')
+        self.assertFalse(self.raildriver_mock.set_controller_value.called)
+
+        sim_time.set_rate(1)
+        clock.advance(2)
+        self.assertFalse(self.machine.sim_time.paused)
+        self.assertEqual(listener.interval, 0.5)
+        self.assertEqual(self.beeper_mock.start.call_count, 2)
+
+        self.machine.usb.execute_bindings('on_depress')
+        sim_time.set_rate(4)
+        clock.advance(40)
+        self.assertEqual(self.machine.sim_time.rate, 4)
+        self.assertEqual(self.machine.current_state.name, 'idle')
+        clock.advance(30)
+        self.assertEqual(self.machine.current_state.name, 'needs_depress')
+
+    def checkpoint_file(self, state, react_by, model_name='GenericDSDModel', age=1.0):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        checkpoint_file = dsd.CheckpointFile(os.path.join(directory, 'dsd.checkpoint'))
+        self.addCleanup(checkpoint_file.close)
+        checkpoint_file.write(dsd.Checkpoint(state, react_by, self.raildriver_mock.get_loco_name.return_value,
+                                             model_name, time.time() - age))
+        return checkpoint_file
+
+    def test_resume_armed_from_checkpoint(self):
+        """
+        A restarted process should carry on with the saved state and deadline instead of starting inactive, and
+        skip the isolation delay of a loco that was already set up
+        """
+        self.raildriver_controller_values['Reverser'] = 1
+        checkpoint_file = self.checkpoint_file('needs_depress', datetime.time(12, 30, 2), 'Class66APDSDModel')
+        with mock.patch('dsd.machine.MODEL_MAPPING', {'Default': dsd.machine.models.Class66APDSDModel}):
+            start = time.time()
+            self.machine = dsd.DSDMachine(checkpoint=checkpoint_file)
+            self.assertLess(time.time() - start, 1.0)
+        self.assertEqual(self.machine.current_state.name, 'needs_depress')
+        self.assertEqual(self.machine.model.react_by, datetime.time(12, 30, 2))
+        self.assertTrue(self.beeper_mock.start.called)
+        self.raildriver_mock.get_current_time.return_value = datetime.time(12, 30, 2)
+        self.machine.raildriver_listener._execute_bindings('on_time_change', datetime.time(12, 30, 2), None)
+        self.raildriver_mock.set_controller_value.assert_called_with('EmergencyBrake', 1)
+
+    def test_checkpoint_not_resumed(self):
+        """
+        Stale checkpoints, checkpoints of another model and idle with the reverser now in neutral start afresh
+        """
+        for checkpoint_file in (self.checkpoint_file('idle', datetime.time(12, 31), age=120),
+                                self.checkpoint_file('idle', datetime.time(12, 31), 'Class66APDSDModel'),
+                                self.checkpoint_file('idle', datetime.time(12, 31))):
+            self.machine = dsd.DSDMachine(checkpoint=checkpoint_file)
+            self.assertEqual(self.machine.current_state.name, 'inactive')
+            self.machine.close()
+
+    def test_transitions_and_activity_are_checkpointed(self):
+        checkpoint_file = self.checkpoint_file('inactive', None)
+        self.machine = dsd.DSDMachine(checkpoint=checkpoint_file)
+        self.machine.set_state('idle')
+        self.assertEqual(checkpoint_file.pending.state, 'idle')
+        checkpoint_file.pending = None
+        self.raildriver_mock.get_current_time.return_value = datetime.time(12, 30, 30)
+        self.machine.raildriver_listener._execute_bindings('on_activity', {'Regulator': 0.5})
+        self.assertEqual(checkpoint_file.pending.react_by, datetime.time(12, 31, 30))
+        checkpoint_file.close()
+        reopened = dsd.CheckpointFile(checkpoint_file.path)
+        self.addCleanup(reopened.close)
+        self.assertEqual(reopened.load()[:4], (
+            'idle', datetime.time(12, 31, 30), ['DTG', 'Class 55', 'Class 55 BR Blue'], 'GenericDSDModel'))
+
+    def test_publishes_state_deadline_and_pedal(self):
+        publisher = mock.Mock()
+        self.machine = dsd.DSDMachine(publisher=publisher)
+        self.machine.set_state('needs_depress')
+        self.machine.usb.execute_bindings('on_depress')
+        self.machine.raildriver_listener._execute_bindings('on_activity', {'Regulator': 0.5})
+        self.assertEqual(publisher.mock_calls, [
+            mock.call.publish_state('inactive', None),
+            mock.call.publish_state('needs_depress', datetime.time(12, 30, 6)),
+            mock.call.publish_pedal(True),
+            mock.call.publish_state('idle', datetime.time(12, 31)),
+            mock.call.publish_deadline(datetime.time(12, 31)),
+        ])
+
+    def test_telemetry_records_transitions_pedal_and_deadlines(self):
+        """
+        Every state transition, pedal edge and timeout should be recorded and reaction time derived from them
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        recorder = dsd.TelemetryRecorder(directory)
+        self.machine = dsd.DSDMachine(telemetry=recorder)
+        self.machine.set_state('needs_depress')
+        self.machine.usb.execute_bindings('on_depress')
+        recorder.close()
+
+        records = list(dsd.telemetry.read_records(directory))
+        self.assertEqual([(dsd.telemetry.KIND_NAMES[record.kind], dsd.telemetry.STATES[record.state])
+                          for record in records], [
+            ('session_start', None),
+            ('transition', 'inactive'),
+            ('deadline', 'inactive'),
+            ('transition', 'needs_depress'),
+            ('deadline', 'needs_depress'),
+            ('pedal_depress', 'needs_depress'),
+            ('transition', 'idle'),
+            ('deadline', 'idle'),
+        ])
+        self.assertEqual(records[4].value, 12 * 3600 + 30 * 60 + 6)
+        self.assertEqual(recorder.summary.reaction_times.count, 1)
+
+
+class ProbeTestCase(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = dsd.LatencyHistogram()
+        for seconds in [0.0001] * 98 + [0.003, 5.0]:
+            histogram.add(seconds)
+        self.assertEqual(histogram.percentile(50), 128e-6)
+        self.assertEqual(histogram.percentile(99), 4096e-6)
+        self.assertEqual(histogram.percentile(100), 5.0)
+        other = dsd.LatencyHistogram()
+        other.add(0.0001)
+        histogram.merge(other)
+        self.assertEqual((histogram.count, histogram.maximum), (101, 5.0))
+
+    def test_profile_against_emulator(self):
+        rail_driver = dsd.EmulatedRailDriver.for_model(dsd.machine.models.Class66APDSDModel)
+        rail_driver.latencies['Regulator'] = 0.002
+        profiles = dsd.probe.profile_controls(rail_driver, iterations=5, write=True)
+        by_name = dict((profile.name, profile) for profile in profiles)
+        self.assertEqual(sorted(by_name), sorted(rail_driver.controls))
+        self.assertGreaterEqual(by_name['Regulator'].get.mean, 0.002)
+        self.assertLess(by_name['Horn'].get.mean, 0.002)
+        self.assertEqual(by_name['Horn'].set.count, 5)
+        self.assertEqual(dsd.probe.suggest_important_controls(profiles),
+                         ['AWSReset', 'Horn', 'Regulator', 'Reverser', 'TrainBrakeControl'])
+
+        report = dsd.probe.format_report(rail_driver.loco_name, profiles,
+                                         dsd.probe.profile_special_fields(rail_driver, 5), True)
+        self.assertIn("        'TrainBrakeControl',", report)
+        self.assertIn('dsd_controller_name = one of DSDIsolation', report)
+
+    def test_suggested_listener_interval(self):
+        self.assertEqual(dsd.probe.suggest_listener_interval(0.0005), 0.05)
+        self.assertEqual(dsd.probe.suggest_listener_interval(0.01), 0.1)
+        self.assertEqual(dsd.probe.suggest_listener_interval(0.012), 0.15)
+
+    @mock.patch('sys.stdout')
+    def test_command(self, stdout):
+        self.assertEqual(dsd.probe.__main__(['--emulate', 'GenericDSDModel', '--iterations', '3', '--latency', '0']),
+                         0)
+        with self.assertRaises(SystemExit):
+            dsd.probe.__main__(['--emulate', 'NoSuchModel'])
+
+
+class SimTimeTrackerTestCase(unittest.TestCase):
+
+    def run_tracker(self, tracker, sim_time, seconds, step=0.1):
+        for _ in range(int(round(seconds / step))):
+            tracker.observe(sim_time(), sim_time.clock.time())
+            sim_time.clock.now += step
+
+    def setUp(self):
+        self.clock = mock.Mock(now=12 * 3600.0, time=lambda: self.clock.now)
+        self.sim_time = FakeSimTime(self.clock)
+        self.tracker = dsd.SimTimeTracker()
+        self.events = []
+        self.tracker.on_pause(lambda: self.events.append(('pause', self.clock.now - 12 * 3600)))
+        self.tracker.on_resume(lambda: self.events.append(('resume', self.clock.now - 12 * 3600)))
+        self.tracker.on_rate_change(lambda rate, _: self.events.append(('rate', round(rate, 1))))
+
+    def test_real_time_jitter_is_ignored(self):
+        self.run_tracker(self.tracker, self.sim_time, 600, step=0.37)
+        self.assertEqual(self.events, [])
+        self.assertEqual(self.tracker.scale(60), 60)
+
+    def test_pause_and_resume(self):
+        self.run_tracker(self.tracker, self.sim_time, 10)
+        self.sim_time.set_rate(0)
+        self.run_tracker(self.tracker, self.sim_time, 60)
+        self.sim_time.set_rate(1)
+        self.run_tracker(self.tracker, self.sim_time, 10)
+        self.assertEqual([kind for kind, _ in self.events], ['pause', 'resume'])
+        self.assertLessEqual(self.events[0][1] - 10, self.tracker.pause_timeout + 1)
+        self.assertLessEqual(self.events[1][1] - 70, 1)
+
+    def test_acceleration(self):
+        self.run_tracker(self.tracker, self.sim_time, 10)
+        self.sim_time.set_rate(4)
+        self.run_tracker(self.tracker, self.sim_time, 20)
+        self.assertEqual(self.events[-1], ('rate', 4.0))
+        self.assertAlmostEqual(self.tracker.scale(60), 240, delta=5)
+        self.sim_time.set_rate(1)
+        self.run_tracker(self.tracker, self.sim_time, 20)
+        self.assertEqual(self.events[-1], ('rate', 1.0))
+
+    def test_time_jump_is_not_acceleration(self):
+        self.run_tracker(self.tracker, self.sim_time, 10)
+        self.sim_time.seconds += 3600
+        self.run_tracker(self.tracker, self.sim_time, 20)
+        self.assertEqual(self.events, [])
+
+
+class StandbyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = dsd.VirtualClock()
+        self.raildriver = mock.Mock()
+        self.raildriver.get_loco_name.return_value = None
+        self.results = []
+
+    def start(self, standby, stopped=None):
+        thread = threading.Thread(target=lambda: self.results.append((standby.wait(stopped), self.clock.time())))
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.assertTrue(self.clock.wait_for_sleepers(1))
+        return thread
+
+    def test_backoff_and_bounded_detection_latency(self):
+        standby = dsd.Standby(max_interval=2.0, raildriver_factory=lambda: self.raildriver, clock=self.clock)
+        thread = self.start(standby)
+        self.clock.advance(3600)
+        self.assertLess(standby.probes, 3600 / 2.0 + 10)
+        self.raildriver.get_loco_name.return_value = ['DTG', 'Class 55', 'Class 55 BR Blue']
+        self.clock.advance(2.0)
+        thread.join(5)
+        loco_name, found_at = self.results[0]
+        self.assertEqual(loco_name, ['DTG', 'Class 55', 'Class 55 BR Blue'])
+        self.assertLessEqual(found_at - 3600, 2.0)
+
+    def test_retries_raildriver_until_simulator_runs(self):
+        raildrivers = [OSError('DLL not found'), OSError('DLL not found'), self.raildriver]
+
+        def factory():
+            raildriver = raildrivers.pop(0)
+            if isinstance(raildriver, Exception):
+                raise raildriver
+            return raildriver
+
+        self.raildriver.get_loco_name.return_value = ['DTG', 'Class 55', 'Class 55 BR Blue']
+        standby = dsd.Standby(raildriver_factory=factory, clock=self.clock)
+        thread = self.start(standby)
+        self.clock.advance(10)
+        thread.join(5)
+        self.assertEqual(self.results[0][0], ['DTG', 'Class 55', 'Class 55 BR Blue'])
+        self.assertEqual(standby.probes, 3)
+
+    def test_stop(self):
+        stopped = threading.Event()
+        thread = self.start(dsd.Standby(raildriver_factory=lambda: self.raildriver, clock=self.clock), stopped)
+        stopped.set()
+        thread.join(5)
+        self.assertEqual(self.results[0][0], None)
+
+
+class WatchdogTestCase(unittest.TestCase):
+
+    def inject_fault(self, watchdog, name, fault):
+        """
+        Runs the watchdog, injects a fault and returns (time to detect, time to recover) of the component
+        """
+        watchdog.start()
+        self.addCleanup(watchdog.stop)
+        time.sleep(0.05)
+        injected_at = time.time()
+        fault()
+        component = watchdog.components[name]
+        while component.recovery_time is None and time.time() - injected_at < 5:
+            time.sleep(0.005)
+        self.assertEqual(component.recovered, 1)
+        return component.detected_at - injected_at, component.recovery_time
+
+    def test_heartbeat_stall(self):
+        watchdog = dsd.Watchdog(timeout=0.1, interval=0.02)
+        worker = {'beating': True, 'generation': 0}
+
+        def beat_loop(generation):
+            while worker['generation'] == generation:
+                if worker['beating']:
+                    watchdog.beat('worker')
+                time.sleep(0.01)
+
+        def recover():
+            worker['generation'] += 1
+            worker['beating'] = True
+            threading.Thread(target=beat_loop, args=(worker['generation'],)).start()
+
+        watchdog.watch('worker', recover)
+        recover()
+        self.addCleanup(worker.update, generation=None)
+        time_to_detect, time_to_recover = self.inject_fault(watchdog, 'worker',
+                                                            lambda: worker.update(beating=False))
+        self.assertLessEqual(time_to_detect, 0.1 + 0.02 * 3)
+        self.assertLessEqual(time_to_recover, 0.05)
+
+    def test_probe_failure(self):
+        watchdog = dsd.Watchdog(timeout=0.1, interval=0.02)
+        device = {'alive': True}
+        watchdog.watch('device', lambda: device.update(alive=True), probe=lambda: device['alive'])
+        time_to_detect, time_to_recover = self.inject_fault(watchdog, 'device', lambda: device.update(alive=False))
+        self.assertLessEqual(time_to_detect, 0.02 * 3)
+        self.assertLessEqual(time_to_recover, 0.02 * 3)
+
+    def test_failing_component_backs_off(self):
+        """
+        A component that never comes back should be rebuilt less and less often
+        """
+        clock = dsd.VirtualClock(1000.0)
+        watchdog = dsd.Watchdog(timeout=1.0, clock=clock)
+        recover = mock.Mock()
+        watchdog.watch('device', recover, probe=lambda: False)
+        attempts = []
+        for second in range(40):
+            if watchdog.check():
+                attempts.append(second)
+            clock.advance(1)
+        self.assertEqual(attempts, [0, 1, 3, 7, 15, 31])
+
+        watchdog.components['device'].probe = lambda: True
+        watchdog.check()
+        self.assertEqual(watchdog.components['device'].failures, 0)
+
+    def test_inactive_component_is_not_rebuilt(self):
+        watchdog = dsd.Watchdog(timeout=0.1)
+        recover = mock.Mock()
+        watchdog.watch('beeper', recover, is_active=lambda: False)
+        watchdog.components['beeper'].last_beat -= 10
+        self.assertEqual(watchdog.check(), [])
+        self.assertFalse(recover.called)
+
+
+class ConformanceTestCase(unittest.TestCase):
+
+    def test_every_model_conforms(self):
+        results = conformance.run(random_steps=20, processes=1)
+        self.assertEqual(sorted(result.model for result in results), conformance.model_names())
+        self.assertEqual([failure for result in results for failure in result.failures], [])
+        for result in results:
+            self.assertEqual(set(result.transitions) & conformance.EXPECTED_TRANSITIONS,
+                             conformance.EXPECTED_TRANSITIONS)
+
+
+class PublisherTestCase(unittest.TestCase):
+
+    port = 47147
+
+    def publisher(self, **kwargs):
+        kwargs.setdefault('status_block', 'railworksdsd-test-{}'.format(os.getpid()))
+        publisher = dsd.StatePublisher(port=self.port, **kwargs)
+        self.addCleanup(publisher.close)
+        return publisher
+
+    def subscriber(self):
+        subscriber = dsd.Subscriber(port=self.port)
+        self.addCleanup(subscriber.close)
+        return subscriber
+
+    def test_state_change_reaches_every_subscriber(self):
+        subscribers = [self.subscriber() for _ in range(3)]
+        publisher = self.publisher()
+        publisher.publish_time(datetime.time(12, 30))
+        publisher.publish_state('needs_depress', datetime.time(12, 30, 6))
+        for subscriber in subscribers:
+            frame = subscriber.receive(timeout=5)
+            self.assertEqual(frame.kind, dsd.publisher.State)
+            self.assertEqual(dsd.telemetry.STATES[frame.state], 'needs_depress')
+            self.assertEqual(frame.seconds_left, 6)
+            self.assertEqual(len(frame.pack()), 32)
+
+    def test_status_block(self):
+        publisher = self.publisher()
+        reader = dsd.StatusBlock(publisher.status_block.memory.name, create=False)
+        self.addCleanup(reader.close)
+        self.assertEqual(reader.read().state, 0)
+        publisher.publish_pedal(True)
+        publisher.publish_state('idle', datetime.time(12, 31))
+        status = reader.read()
+        self.assertEqual((status.kind, dsd.telemetry.STATES[status.state], status.pedal),
+                         (dsd.publisher.State, 'idle', dsd.publisher.PedalDepressed))
+        self.assertEqual(status.sequence, 2)
+
+    def test_countdown_frames_only_with_deadline(self):
+        clock = dsd.VirtualClock()
+        subscriber = self.subscriber()
+        publisher = self.publisher(clock=clock, countdown_interval=1.0, status_block=None)
+        publisher.start()
+        self.assertTrue(clock.wait_for_sleepers(1))
+        clock.advance(3)
+        self.assertIsNone(subscriber.receive(timeout=0.1))
+        publisher.publish_deadline(datetime.time(12, 31))
+        publisher.publish_deadline(datetime.time(12, 31))
+        clock.advance(2)
+        self.assertEqual([subscriber.receive(timeout=5).kind for _ in range(3)],
+                         [dsd.publisher.Deadline, dsd.publisher.Countdown, dsd.publisher.Countdown])
+        self.assertIsNone(subscriber.receive(timeout=0.1))
+
+
+class TelemetryTestCase(unittest.TestCase):
+
+    def test_segments_roundtrip(self):
+        """
+        Records should survive segment boundaries and come back in order
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        recorder = dsd.TelemetryRecorder(directory, segment_records=3)
+        for value in range(10):
+            recorder.record(dsd.telemetry.Deadline, 'idle', value)
+        recorder.close()
+        self.assertEqual(len(os.listdir(directory)), 4)  # session start and 10 deadlines
+        self.assertEqual([record.value for record in dsd.telemetry.read_records(directory, chunk_records=2)][1:],
+                         list(range(10)))
+
+    def test_reaction_time_percentiles(self):
+        stats = dsd.ReactionTimeStats()
+        for milliseconds in range(1, 1001):
+            stats.add(milliseconds / 1000.0)
+        self.assertEqual(stats.count, 1000)
+        self.assertAlmostEqual(stats.mean, 0.5005)
+        self.assertAlmostEqual(stats.percentile(50), 0.5, delta=2 * stats.bucket_width)
+        self.assertAlmostEqual(stats.percentile(99), 0.99, delta=2 * stats.bucket_width)
+        self.assertEqual(stats.percentile(100), 1.0)
+
+    def test_session_start_resets_pedal_need(self):
+        """
+        A pedal need left over from a previous run must not turn into a reaction time in the next one
+        """
+        summary = dsd.SessionSummary()
+        summary.feed(dsd.Record(1000.0, dsd.telemetry.SessionStart, 0))
+        summary.feed(dsd.Record(1001.0, dsd.telemetry.Transition, 2, 1))
+        summary.feed(dsd.Record(5000.0, dsd.telemetry.SessionStart, 0))
+        summary.feed(dsd.Record(5001.0, dsd.telemetry.PedalDepress, 1))
+        self.assertEqual(summary.sessions, 2)
+        self.assertEqual(summary.reaction_times.count, 0)